@@ -6,10 +6,12 @@ import os
 
 bot = discord.Bot(intents=discord.Intents.all())
 
-db = MySQLHelper(**MYSQL_CONFIG)
+db = MySQLHelper(**MYSQL_CONFIG, autocommit=True)
+bot.db = db
+# Survives reload_extension, which re-imports cogs and resets any module or class level flag
+bot.ensured_tables = set()
 
-@bot.event
-async def on_ready():
+def ensure_core_tables():
     create_guilds_table = """
         CREATE TABLE IF NOT EXISTS guilds (
             id INT AUTO_INCREMENT PRIMARY KEY,
@@ -20,11 +22,14 @@ async def on_ready():
             )
         """
     db.create_table(create_guilds_table)
+
+@bot.event
+async def on_ready():
     print(f"{bot.user} has connected to Discord!")
 
 @bot.event
 async def on_guild_join(guild: discord.Guild):
-    db.insert("guilds", {"guild_id": guild.id})
+    await db.run(db.ensure_guild, guild.id)
 
 
 @bot.event
@@ -33,9 +38,13 @@ async def on_close():
     print("Database connections closed.")
 
 if __name__ == "__main__":
-    for filename in os.listdir('./cogs'):
-        if filename.endswith('.py'):
-            bot.load_extension(f"cogs.{filename[:-3]}")
+    ensure_core_tables()
+    for filename in sorted(os.listdir('./cogs')):
+        if filename.endswith('.py') and not filename.startswith('_'):
+            extension = f"cogs.{filename[:-3]}"
+            if extension in bot.extensions:
+                continue
+            bot.load_extension(extension)
             print(f"Loaded Extension: {filename[:-3]}")
         else:
             continue
@@ -1,24 +1,114 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.commands import SlashCommandGroup, Option
-from datetime import datetime
+import time
 import random 
 import io
+import math
 from PIL import Image, ImageDraw, ImageFont
 import logging
-from utils.mysql_helper import MySQLHelper
-from config import MYSQL_CONFIG
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+XP_FLUSH_INTERVAL = 5
+XP_FLUSH_THRESHOLD = 500
+COOLDOWN_CACHE_SIZE = 200_000
+COOLDOWN_TTL = 3600
+USER_CACHE_SIZE = 100_000
+USER_CACHE_TTL = 900
+SETTINGS_CACHE_SIZE = 10_000
+SETTINGS_CACHE_TTL = 60
+
+
+_XP_TABLE_SIZE = 1024
+_XP_TABLE = tuple(5 * level * level + 50 * level + 100 for level in range(_XP_TABLE_SIZE))
+
+
+def xp_needed(level: int) -> int:
+    if level < _XP_TABLE_SIZE:
+        return _XP_TABLE[level]
+    return 5 * level * level + 50 * level + 100
+
+
+def _total_xp_formula(level: int) -> int:
+    # Closed form of sum(5k^2 + 50k + 100 for k in range(level))
+    return 5 * (level - 1) * level * (2 * level - 1) // 6 + 25 * level * (level - 1) + 100 * level
+
+
+_TOTAL_XP_TABLE = tuple(_total_xp_formula(level) for level in range(_XP_TABLE_SIZE))
+
+
+def total_xp_for_level(level: int) -> int:
+    if level < _XP_TABLE_SIZE:
+        return _TOTAL_XP_TABLE[level]
+    return _total_xp_formula(level)
+
+
+def level_for_total_xp(total_xp: int) -> int:
+    level = int(math.pow(max(total_xp, 0) * 3 / 5, 1 / 3))
+    while level > 0 and total_xp_for_level(level) > total_xp:
+        level -= 1
+    while total_xp_for_level(level + 1) <= total_xp:
+        level += 1
+    return level
+
+
 class Leveling(commands.Cog):
+    _UPSERT_SQL = """
+        INSERT INTO levels (user_id, guild_id, xp, level, total_xp)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE total_xp = total_xp + VALUES(total_xp), level = VALUES(level), xp = VALUES(xp)
+    """
+
     def __init__(self, bot):
         self.bot = bot
-        self.db = MySQLHelper(**MYSQL_CONFIG)
-        self.cooldowns = {}
+        self.db = bot.db
+        self.cooldowns = TTLCache(maxsize=COOLDOWN_CACHE_SIZE, ttl=COOLDOWN_TTL)
+        self._settings_cache = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_CACHE_TTL)
+        self._user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+        self._pending_xp = {}
+        self._flushing_xp = {}
+        self._xp_flush_future = None
+        self._level_up_tasks = set()
+        self._avatar_cache = TTLCache(maxsize=1024, ttl=600)
+        self._render_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rank_card")
+        self._load_card_assets()
         self._ensure_tables()
+        self.flush_xp_loop.start()
+
+    def cog_unload(self):
+        self.flush_xp_loop.cancel()
+        self._render_pool.shutdown(wait=False)
+        # XP rows are deltas, so the in-flight batch must land exactly once: wait for it and resend it only if it failed
+        if self._flushing_xp and not self.db.succeeded(self._xp_flush_future):
+            self._merge_pending(self._pending_xp, self._flushing_xp)
+        self._flushing_xp = {}
+        if self._pending_xp:
+            self.db.execute_many(self._UPSERT_SQL, self._upsert_rows(self._pending_xp))
+
+    def _load_card_assets(self):
+        try:
+            self._font_bold = ImageFont.truetype("assets/fonts/arialbd.ttf", 30)
+            self._font_regular = ImageFont.truetype("assets/fonts/arial.ttf", 22)
+            self._font_small = ImageFont.truetype("assets/fonts/arial.ttf", 18)
+        except OSError:
+            self._font_bold = ImageFont.load_default()
+            self._font_regular = ImageFont.load_default()
+            self._font_small = ImageFont.load_default()
+
+        self._avatar_mask = Image.new('L', (128, 128), 0)
+        ImageDraw.Draw(self._avatar_mask).ellipse((0, 0, 128, 128), fill=255)
+
+        self._card_template = Image.new("RGB", (600, 180), color=(54, 57, 63))
+        ImageDraw.Draw(self._card_template).rectangle([150, 140, 550, 160], fill=(100, 100, 100))
 
     def _ensure_tables(self):
+        if "leveling" in self.bot.ensured_tables:
+            return
+
         create_levels_table = """
             CREATE TABLE IF NOT EXISTS levels (
                 id INT AUTO_INCREMENT PRIMARY KEY,
@@ -32,10 +122,14 @@ class Leveling(commands.Cog):
                 UNIQUE KEY unique_user_guild (user_id, guild_id),
                 INDEX idx_user_id (user_id),
                 INDEX idx_guild_id (guild_id),
-                INDEX idx_level (level)
+                INDEX idx_level (level),
+                INDEX idx_lb (guild_id, level, total_xp)
             )
         """
         self.db.create_table(create_levels_table)
+
+        if not self.db.index_exists("levels", "idx_lb"):
+            self.db.execute_query("CREATE INDEX idx_lb ON levels (guild_id, level, total_xp)")
         
         create_settings_table = """
             CREATE TABLE IF NOT EXISTS level_settings (
@@ -52,18 +146,23 @@ class Leveling(commands.Cog):
             )
         """
         self.db.create_table(create_settings_table)
+        self.bot.ensured_tables.add("leveling")
         logger.info("Leveling tables ensured")
 
     def xp_needed(self, level: int) -> int:
-        return 5 * (level ** 2) + 50 * level + 100
+        return xp_needed(level)
     
-    def _get_guild_settings(self, guild_id: int) -> dict:
+    async def _get_guild_settings(self, guild_id: int) -> dict:
+        cached = self._settings_cache.get(guild_id)
+        if cached is not None:
+            return cached
+
         query = "SELECT * FROM level_settings WHERE guild_id = %s"
-        result = self.db.fetch_one_dict(query, (guild_id,))
+        result = await self.db.run(self.db.fetch_one_dict, query, (guild_id,))
 
         if not result:
-            self.db.insert("level_settings", {"guild_id": guild_id})
-            return {
+            await self.db.run(self.db.insert, "level_settings", {"guild_id": guild_id})
+            result = {
                 "enabled": True,
                 "level_up_channel_id": None,
                 "level_up_message": None,
@@ -71,91 +170,162 @@ class Leveling(commands.Cog):
                 "min_xp": 15,
                 "max_xp": 25
             }
+
+        self._settings_cache.set(guild_id, result)
         return result
+
+    def invalidate_guild_settings(self, guild_id: int) -> None:
+        self._settings_cache.pop(guild_id)
     
-    def _get_user_data(self, user_id: int, guild_id: int) -> dict:
+    def _cached_user_data(self, key: tuple):
+        user_data = self._user_cache.get(key)
+        if user_data is not None:
+            return user_data
+
+        entry = self._pending_xp.get(key) or self._flushing_xp.get(key)
+        if entry is not None:
+            self._user_cache.set(key, entry[0])
+            return entry[0]
+        return None
+
+    async def _get_user_data(self, user_id: int, guild_id: int) -> dict:
+        key = (user_id, guild_id)
+        user_data = self._cached_user_data(key)
+        if user_data is not None:
+            return user_data
+
         query = """
             SELECT user_id, guild_id, xp, level, total_xp
             FROM levels
             WHERE user_id = %s AND guild_id = %s
         """
-        result = self.db.fetch_one_dict(query, (user_id, guild_id))
+        result = await self.db.run(self.db.fetch_one_dict, query, (user_id, guild_id))
 
         if not result:
-            return {
+            result = {
                 "user_id": user_id,
                 "guild_id": guild_id,
                 "xp": 0,
                 "level": 0,
                 "total_xp": 0
             }
-        
+
+        user_data = self._cached_user_data(key)
+        if user_data is not None:
+            return user_data
+        self._user_cache.set(key, result)
         return result
     
-    def _upsert_user_data(self, user_data: dict) -> bool:
-        existing = self.db.fetch_one(
-            "SELECT id FROM levels WHERE user_id = %s AND guild_id = %s",
-            (user_data["user_id"], user_data["guild_id"])
-        )
-        
-        if existing:
-            return self.db.update(
-                table="levels",
-                data={
-                    "xp":  user_data["xp"],
-                    "level": user_data["level"],
-                    "total_xp": user_data["total_xp"]
-                },
-                where_clause="user_id = %s AND guild_id = %s",
-                where_params=(user_data["user_id"], user_data["guild_id"])
-            )
-        else:
-            result = self.db.insert(
-                "levels",
-                {
-                    "user_id": user_data["user_id"],
-                    "guild_id": user_data["guild_id"],
-                    "xp": user_data["xp"],
-                    "level": user_data["level"],
-                    "total_xp":  user_data["total_xp"]
-                }
-            )
-            return result is not None
+    async def _get_rank_data(self, user_id: int, guild_id: int) -> tuple:
+        key = (user_id, guild_id)
+        user_data = self._cached_user_data(key)
+        if user_data is not None:
+            rank_query = """
+                SELECT COUNT(*) + 1 AS user_rank
+                FROM levels
+                WHERE guild_id = %s
+                AND (level > %s OR (level = %s AND total_xp > %s))
+            """
+            rank_result = await self.db.run(self.db.fetch_one, rank_query, (guild_id, user_data['level'], user_data['level'], user_data['total_xp']))
+            return user_data, rank_result[0] if rank_result else 1
+
+        query = """
+            SELECT l.user_id, l.guild_id, l.xp, l.level, l.total_xp,
+                (
+                    SELECT COUNT(*) + 1
+                    FROM levels r
+                    WHERE r.guild_id = l.guild_id
+                    AND (r.level > l.level OR (r.level = l.level AND r.total_xp > l.total_xp))
+                ) AS user_rank
+            FROM levels l
+            WHERE l.user_id = %s AND l.guild_id = %s
+        """
+        result = await self.db.run(self.db.fetch_one_dict, query, (user_id, guild_id))
+
+        if not result:
+            return {
+                "user_id": user_id,
+                "guild_id": guild_id,
+                "xp": 0,
+                "level": 0,
+                "total_xp": 0
+            }, 1
+
+        rank = result.pop("user_rank")
+        if self._cached_user_data(key) is None:
+            self._user_cache.set(key, result)
+        return result, rank
+
+    def _upsert_rows(self, pending: dict) -> list:
+        return [(d["user_id"], d["guild_id"], d["xp"], d["level"], gained) for d, gained in pending.values()]
+
+    @staticmethod
+    def _merge_pending(target: dict, source: dict) -> dict:
+        for key, (user_data, gained) in source.items():
+            entry = target.get(key)
+            target[key] = (user_data, gained + entry[1]) if entry else (user_data, gained)
+        return target
+
+    async def _flush_xp(self) -> None:
+        if not self._pending_xp or self._flushing_xp:
+            return
+
+        self._flushing_xp, self._pending_xp = self._pending_xp, {}
+        self._xp_flush_future = self.db.submit(self.db.execute_many, self._UPSERT_SQL, self._upsert_rows(self._flushing_xp))
+        try:
+            success = await asyncio.wrap_future(self._xp_flush_future)
+            if not success:
+                self._merge_pending(self._pending_xp, self._flushing_xp)
+        finally:
+            self._flushing_xp = {}
+            self._xp_flush_future = None
+
+    async def _send_level_up(self, channel: discord.abc.Messageable, message: str) -> None:
+        try:
+            await channel.send(message)
+        except discord.Forbidden:
+            logger.warning(f"Cannot send level up message in guild {channel.guild.id}")
+        except discord.HTTPException as e:
+            logger.error(f"Failed to send level up message in guild {channel.guild.id}: {e}")
+
+    @tasks.loop(seconds=XP_FLUSH_INTERVAL)
+    async def flush_xp_loop(self):
+        await self._flush_xp()
     
     @commands.Cog.listener()
     async def on_message(self, message):
         if message.author.bot or not message.guild:
             return
         
-        settings = self._get_guild_settings(message.guild.id)
+        settings = await self._get_guild_settings(message.guild.id)
 
         if not settings["enabled"]:
             return
         
         user_id = message.author.id
-        cooldown_key = f"{user_id}_{message.guild.id}"
+        cooldown_key = (user_id, message.guild.id)
 
-        now = datetime.utcnow()
+        now = time.monotonic()
         last_time = self.cooldowns.get(cooldown_key)
-        if last_time and (now - last_time).total_seconds() < settings["xp_cooldown"]:
+        if last_time is not None and now - last_time < settings["xp_cooldown"]:
             return
-        self.cooldowns[cooldown_key] = now
+        self.cooldowns.set(cooldown_key, now)
 
-        user_data = self._get_user_data(user_id, message.guild.id)
+        user_data = await self._get_user_data(user_id, message.guild.id)
 
         gained_xp = random.randint(settings["min_xp"], settings["max_xp"])
-        user_data['xp'] += gained_xp
         user_data['total_xp'] += gained_xp
 
-        leveled_up = False
-        levels_gained = 0
-        while user_data["xp"] >= self.xp_needed(user_data["level"]):
-            user_data["xp"] -= self.xp_needed(user_data["level"])
-            user_data["level"] += 1
-            levels_gained += 1
-            leveled_up = True
+        new_level = level_for_total_xp(user_data["total_xp"])
+        leveled_up = new_level > user_data["level"]
+        user_data["level"] = new_level
+        user_data["xp"] = user_data["total_xp"] - total_xp_for_level(new_level)
 
-        self._upsert_user_data(user_data)
+        key = (user_id, message.guild.id)
+        entry = self._pending_xp.get(key)
+        self._pending_xp[key] = (user_data, gained_xp + entry[1]) if entry else (user_data, gained_xp)
+        if len(self._pending_xp) >= XP_FLUSH_THRESHOLD:
+            await self._flush_xp()
 
         if leveled_up:
             level_up_message = settings.get("level_up_message") or f"{message.author.mention} leveled up to **Level {user_data['level']}**!"
@@ -168,10 +338,9 @@ class Leveling(commands.Cog):
                 if level_up_channel:
                     channel = level_up_channel
             
-            try:
-                await channel.send(level_up_message)
-            except discord.Forbidden:
-                logger.warning(f"Cannot send level up message in guild {message.guild.id}")
+            task = asyncio.create_task(self._send_level_up(channel, level_up_message))
+            self._level_up_tasks.add(task)
+            task.add_done_callback(self._level_up_tasks.discard)
 
 
     level = SlashCommandGroup("level", "Leveling system commands")
@@ -181,14 +350,14 @@ class Leveling(commands.Cog):
         await ctx.defer()
         member = member or ctx.author
 
-        user_data = self._get_user_data(member.id, ctx.guild.id)
+        user_data, rank = await self._get_rank_data(member.id, ctx.guild.id)
 
         if user_data["level"] == 0 and user_data["xp"] == 0:
             await ctx.respond("This user has no level data yet. Send a message to gain XP!")
             return
         
         try:
-            img = await self.generate_level_card(member, user_data, ctx.guild.id)
+            img = await self.generate_level_card(member, user_data, rank)
             file = discord.File(fp=img, filename="rank.png")
             await ctx.respond(file=file)
         except Exception as e:
@@ -210,44 +379,62 @@ class Leveling(commands.Cog):
             LIMIT %s OFFSET %s
         """
 
-        results = self.db.fetch_all_dict(query, (ctx.guild.id, per_page, offset))
+        results = await self.db.run(self.db.fetch_all_dict, query, (ctx.guild.id, per_page, offset))
 
         if not results:
             await ctx.respond("No leaderboard data available yet!")
             return
         
+        members = {}
+        missing = []
+        for user_data in results:
+            member = ctx.guild.get_member(user_data["user_id"])
+            if member:
+                members[member.id] = member
+            else:
+                missing.append(user_data["user_id"])
+
+        if missing:
+            try:
+                for member in await ctx.guild.query_members(user_ids=missing, limit=len(missing)):
+                    members[member.id] = member
+            except asyncio.TimeoutError:
+                logger.warning(f"Timed out resolving leaderboard members in guild {ctx.guild.id}")
+
         embed = discord.Embed(title=f"{ctx.guild.name} Leaderboard", description=f"Top members by level and XP (Page {page})", color=discord.Color.gold())
         for idx, user_data in enumerate(results, start=offset + 1):
-            user = ctx.guild.get_member(user_data["user_id"])
-            if user:
-                embed.add_field(name=f"{idx}. {user.display_name}", value=f"Level: {user_data['level']} | Total XP: {user_data['total_xp']: ,}", inline=False)
+            member = members.get(user_data["user_id"])
+            name = member.display_name if member else f"Unknown Member ({user_data['user_id']})"
+            embed.add_field(name=f"{idx}. {name}", value=f"Level: {user_data['level']} | Total XP: {user_data['total_xp']:,}", inline=False)
         embed.set_footer(text=f"Page {page}")
         await ctx.respond(embed=embed)
 
-    async def generate_level_card(self,  member : discord.Member, user_data: dict, guild_id: int) -> io.BytesIO:
-        width, height = 600, 180
-        img = Image.new("RGB", (width, height), color=(54, 57, 63))
-        draw = ImageDraw.Draw(img)
+    async def generate_level_card(self,  member : discord.Member, user_data: dict, rank: int) -> io.BytesIO:
+        avatar_key = (member.id, member.display_avatar.key)
+        avatar_img = self._avatar_cache.get(avatar_key)
+        avatar_bytes = None
+        if avatar_img is None:
+            try:
+                avatar_asset = member.display_avatar.with_size(128)
+                avatar_bytes = io.BytesIO()
+                await avatar_asset.save(avatar_bytes)
+                avatar_bytes.seek(0)
+            except Exception as e:
+                avatar_bytes = None
+                logger.error(f"Error loading avatar: {e}")
+
+        loop = asyncio.get_running_loop()
+        output, avatar_img = await loop.run_in_executor(self._render_pool, self._render_card_sync, member.name, avatar_img, avatar_bytes, user_data, rank)
+        if avatar_img is not None:
+            self._avatar_cache.set(avatar_key, avatar_img)
+        return output
 
-        try:
-            font_bold = ImageFont.truetype("assets/fonts/arialbd.ttf", 30)
-            font_regular = ImageFont.truetype("assets/fonts/arial.ttf", 22)
-            font_small = ImageFont.truetype("assets/fonts/arial.ttf", 18)
-        except:
-            font_bold = ImageFont.load_default()
-            font_regular = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-
-        rank_query = """
-            SELECT COUNT(*) + 1 as rank
-            FROM levels
-            WHERE guild_id = %s
-            AND (level > %s OR (level = %s AND total_xp > %s))
-        """
-        rank_result = self.db.fetch_one(rank_query, (guild_id, user_data['level'], user_data['level'], user_data['total_xp']))
-        rank = rank_result[0] if rank_result else 1
+    def _render_card_sync(self, name: str, avatar_img: Image.Image, avatar_bytes: io.BytesIO, user_data: dict, rank: int) -> tuple:
+        img = self._card_template.copy()
+        draw = ImageDraw.Draw(img)
+        font_bold, font_regular, font_small = self._font_bold, self._font_regular, self._font_small
 
-        username = f"{member.name}"
+        username = f"{name}"
         if len(username) > 20:
             username = username[:17] + "..."
         draw.text((150, 30), username, font=font_bold, fill='white')
@@ -256,39 +443,31 @@ class Leveling(commands.Cog):
 
         draw.text((320, 70), f"Level: {user_data['level']}", font=font_regular, fill='white')
 
-        xp_needed = self.xp_needed(user_data['level'])
-        draw.text((150, 100), f"XP: {user_data['xp']:,} / {xp_needed:,}", font=font_small, fill=(180, 180, 180))
+        level_xp = xp_needed(user_data['level'])
+        draw.text((150, 100), f"XP: {user_data['xp']:,} / {level_xp:,}", font=font_small, fill=(180, 180, 180))
 
         bar_x = 150
         bar_y = 140
         bar_width = 400
         bar_height = 20
 
-        draw.rectangle([bar_x, bar_y, bar_x + bar_width, bar_y + bar_height], fill=(100, 100, 100))
-        if xp_needed > 0:
-            filled_width = int((user_data['xp'] / xp_needed) * bar_width)
+        if level_xp > 0:
+            filled_width = int((user_data['xp'] / level_xp) * bar_width)
             draw.rectangle([bar_x, bar_y, bar_x + filled_width, bar_y + bar_height], fill=(114, 137, 218))
 
-        try:
-            avatar_asset = member.display_avatar.with_size(128)
-            avatar_bytes = io.BytesIO()
-            await avatar_asset.save(avatar_bytes)
-            avatar_bytes.seek(0)
-            avatar_img = Image.open(avatar_bytes).resize((128, 128))
-
-            mask = Image.new('L', (128, 128), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.ellipse((0, 0, 128, 128), fill=255)
+        if avatar_img is None and avatar_bytes is not None:
+            try:
+                avatar_img = Image.open(avatar_bytes).convert("RGB").resize((128, 128), Image.BILINEAR)
+            except Exception as e:
+                logger.error(f"Error loading avatar: {e}")
 
-            img.paste(avatar_img, (10, 26), mask)
-        except Exception as e:
-            logger.error(f"Error loading avatar: {e}")
+        if avatar_img is not None:
+            img.paste(avatar_img, (10, 26), self._avatar_mask)
 
         output = io.BytesIO()
-        img.save(output, 'PNG')
+        img.save(output, 'PNG', compress_level=1, optimize=False)
         output.seek(0)
-        return output
-
+        return output, avatar_img
 
 def setup(bot):
     bot.add_cog(Leveling(bot))
\ No newline at end of file
@@ -1,66 +1,167 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.commands import SlashCommandGroup, Option
-from utils.mysql_helper import MySQLHelper
-from config import MYSQL_CONFIG
-from datetime import datetime, timedelta
-import uuid
+from datetime import datetime, timedelta, timezone
+import secrets
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
 import logging
+from utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+PUNISHMENT_FLUSH_INTERVAL = 0.5
+PUNISHMENT_FLUSH_THRESHOLD = 32
+MOD_LOG_CACHE_SIZE = 10_000
+MOD_LOG_CACHE_TTL = 60
+
+_MISSING = object()
+
+_UNIT_SECONDS = {"minutes": 60, "hours": 3600, "days": 86400, "weeks": 604800}
+
+
+def _precheck(ctx: discord.ApplicationContext, member: discord.Member, bot: discord.Bot, verb: str) -> Optional[str]:
+    if member.id == ctx.guild.owner_id:
+        return f"You cannot {verb} the server owner!"
+    if member.id == ctx.author.id:
+        return f"You cannot {verb} yourself!"
+    if member.id == bot.user.id:
+        return f"I cannot {verb} myself!"
+    if ctx.author.id != ctx.guild.owner_id and member.top_role >= ctx.author.top_role:
+        return f"You cannot {verb} someone with a higher or equal role!"
+    if member.top_role >= ctx.guild.me.top_role:
+        return f"I cannot {verb} someone with a higher or equal role than me!"
+    return None
+
+
+def _build_embed(title: str, color: discord.Color, timestamp: datetime, fields: tuple, footer: dict = None, thumbnail_url: str = None) -> discord.Embed:
+    data = {
+        "type": "rich",
+        "title": title,
+        "color": color.value,
+        "fields": [{"name": name, "value": value, "inline": inline} for name, value, inline in fields]
+    }
+    if footer:
+        data["footer"] = footer
+    if thumbnail_url:
+        data["thumbnail"] = {"url": thumbnail_url}
+
+    embed = discord.Embed.from_dict(data)
+    embed.timestamp = timestamp
+    return embed
+
+_SQL_CREATE_PUNISHMENT = """
+    CREATE TABLE IF NOT EXISTS punishment_actions (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        punishment_id VARCHAR(36) UNIQUE NOT NULL,
+        guild_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        moderator_id BIGINT NOT NULL,
+        action_type VARCHAR(50) NOT NULL,
+        reason TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_guild_id (guild_id),
+        INDEX idx_user_id (user_id),
+        INDEX idx_punishment_id (punishment_id)
+    )
+"""
+_SQL_GET_MODLOG = "SELECT mod_log_channel_id FROM guilds WHERE guild_id = %s"
+_SQL_INSERT_PUNISHMENT = """
+    INSERT INTO punishment_actions (punishment_id, guild_id, user_id, moderator_id, action_type, reason)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
 class Moderation(commands.Cog):
+    _MODLOG_TITLE_PREFIX = "🔨 "
+    _APPEAL_FOOTER = {"text": "If you believe this was a mistake, please contact the server moderators."}
+    _DM_SENT_FOOTER = {"text": "User was notified via DM"}
+    _DM_FAILED_FOOTER = {"text": "Could not notify user via DM"}
+
     def __init__(self, bot):
         self.bot = bot
-        self.db = MySQLHelper(**MYSQL_CONFIG)
-        self._ensure_tables()
-
-    def _ensure_tables(self):
-        create_punishment_table = """
-            CREATE TABLE IF NOT EXISTS punishment_actions (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                punishment_id VARCHAR(36) UNIQUE NOT NULL,
-                guild_id BIGINT NOT NULL,
-                user_id BIGINT NOT NULL,
-                moderator_id BIGINT NOT NULL,
-                action_type VARCHAR(50) NOT NULL,
-                reason TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                INDEX idx_guild_id (guild_id),
-                INDEX idx_user_id (user_id),
-                INDEX idx_punishment_id (punishment_id)
-                )
-            """
-        self.db.create_table(create_punishment_table)
+        self.db = bot.db
+        self._mod_log_cache = TTLCache(maxsize=MOD_LOG_CACHE_SIZE, ttl=MOD_LOG_CACHE_TTL)
+        self._locks = {}
+        self._pending_logs = []
+        self._flushing_logs = []
+        self._logs_flush_future = None
+        self.ensure_tables_task.start()
+        self.flush_logs_loop.start()
+
+    def cog_unload(self):
+        self.ensure_tables_task.cancel()
+        self.flush_logs_loop.cancel()
+        # Resending an in-flight batch would collide on punishment_id and fail the whole insert, so wait for it instead
+        if self._flushing_logs and not self.db.succeeded(self._logs_flush_future):
+            self._pending_logs[:0] = self._flushing_logs
+        self._flushing_logs = []
+        if self._pending_logs:
+            self.db.execute_many(_SQL_INSERT_PUNISHMENT, self._pending_logs)
+
+    def _ensure_tables(self) -> bool:
+        if "moderation" in self.bot.ensured_tables:
+            return True
+
+        if not self.db.create_table(_SQL_CREATE_PUNISHMENT):
+            logger.error("Failed to create moderation tables, retrying on the next log flush")
+            return False
+        self.bot.ensured_tables.add("moderation")
 
         logger.info("Moderation tables ensured")
+        return True
+
+    @tasks.loop(count=1)
+    async def ensure_tables_task(self):
+        await self.db.run(self._ensure_tables)
 
     def _generate_punishment_id(self) -> str:
-        return str(uuid.uuid4())[:8].upper()
+        return secrets.token_hex(4).upper()
     
-    def _get_mod_log_channel(self, guild_id: int) -> int:
-        query = "SELECT mod_log_channel_id FROM guilds WHERE guild_id = %s"
-        result = self.db.fetch_one(query, (guild_id,))
+    async def _get_mod_log_channel(self, guild_id: int) -> int:
+        cached = self._mod_log_cache.get(guild_id, _MISSING)
+        if cached is not _MISSING:
+            return cached
 
-        if result and result[0]:
-            return result[0]
-        return None
+        result = await self.db.run(self.db.fetch_one, _SQL_GET_MODLOG, (guild_id,))
+
+        channel_id = result[0] if result and result[0] else None
+        self._mod_log_cache.set(guild_id, channel_id)
+        return channel_id
+
+    def invalidate_mod_log(self, guild_id: int) -> None:
+        self._mod_log_cache.pop(guild_id)
     
-    def _log_punishment(self, punishment_id: str, guild_id: int, user_id: int, moderator_id: int, action_type: str, reason: str) -> bool:
-        data = {
-            "punishment_id": punishment_id,
-            "guild_id": guild_id,
-            "user_id": user_id,
-            "moderator_id": moderator_id,
-            "action_type": action_type,
-            "reason": reason
-        }
-        
-        result = self.db.insert("punishment_actions", data)
-        return result is not None
+    async def _log_punishment(self, punishment_id: str, guild_id: int, user_id: int, moderator_id: int, action_type: str, reason: str) -> bool:
+        self._pending_logs.append((punishment_id, guild_id, user_id, moderator_id, action_type, reason))
+        if len(self._pending_logs) >= PUNISHMENT_FLUSH_THRESHOLD:
+            await self._flush_logs()
+        return True
+
+    async def _flush_logs(self) -> None:
+        if not self._pending_logs or self._flushing_logs:
+            return
+
+        if "moderation" not in self.bot.ensured_tables and not await self.db.run(self._ensure_tables):
+            return
+
+        self._flushing_logs, self._pending_logs = self._pending_logs, []
+        self._logs_flush_future = self.db.submit(self.db.execute_many, _SQL_INSERT_PUNISHMENT, self._flushing_logs)
+        try:
+            success = await asyncio.wrap_future(self._logs_flush_future)
+            if not success:
+                logger.error(f"Failed to flush {len(self._flushing_logs)} punishment logs, retrying next tick")
+                self._pending_logs[:0] = self._flushing_logs
+        finally:
+            self._flushing_logs = []
+            self._logs_flush_future = None
+
+    @tasks.loop(seconds=PUNISHMENT_FLUSH_INTERVAL)
+    async def flush_logs_loop(self):
+        await self._flush_logs()
     
-    async def _send_mod_log(self, guild: discord.Guild, punishment_id: str, action_type: str, user: discord.User, moderator: discord.Member, reason: str, duration: str = None) -> None:
-        channel_id = self._get_mod_log_channel(guild.id)
+    async def _send_mod_log(self, guild: discord.Guild, punishment_id: str, action_type: str, user: discord.User, moderator: discord.Member, reason: str, duration: str = None, timestamp: datetime = None) -> None:
+        channel_id = await self._get_mod_log_channel(guild.id)
 
         if not channel_id:
             logger.info(f"No mod log channnel configured for guild {guild.id}")
@@ -72,18 +173,7 @@ class Moderation(commands.Cog):
             logger.warning(f"Mod log channel {channel_id} not found in guild {guild.id}")
             return
         
-        embed = discord.Embed(title=f"🔨 {action_type.upper()}", color=discord.Color.red(), timestamp=datetime.utcnow())
-        embed.add_field(name="User", value=f"{user.mention} (`{user.id}`)\n{user.name}#{user.discriminator}", inline=True)
-        embed.add_field(name="Moderator", value=f"{moderator.mention} (`{moderator.id}`)\n{moderator.name}#{moderator.discriminator}", inline=True)
-        embed.add_field(name="Punishment ID", value=f"`{punishment_id}`", inline=True)
-        if duration:
-            embed.add_field(name="Duration", value=duration, inline=True)
-        embed.add_field(name="Reason", value=reason, inline=False)
-
-        if user.avatar:
-            embed.set_thumbnail(url=user.avatar.url)
-        
-        embed.set_footer(text=f"Guild ID: {guild.id}")
+        embed = self._build_modlog_embed(guild, punishment_id, action_type, user, moderator, reason, duration, timestamp)
 
         try:
             await channel.send(embed=embed)
@@ -93,18 +183,63 @@ class Moderation(commands.Cog):
         except discord.HTTPException as e:
             logger.error(f"Failed to send mod log: {e}")
     
-    def _parse_duration(self, duration: str, unit: str) -> timedelta:
-        unit_mapping = {
-            "minutes": timedelta(minutes=duration),
-            "hours": timedelta(hours=duration),
-            "days": timedelta(days=duration),
-            "weeks": timedelta(weeks=duration)
-        }
-        return unit_mapping.get(unit)
+    def _build_modlog_embed(self, guild: discord.Guild, punishment_id: str, action_type: str, user: discord.User, moderator: discord.Member, reason: str, duration: str = None, timestamp: datetime = None) -> discord.Embed:
+        fields = (
+            ("User", f"{user.mention} (`{user.id}`)\n{user.name}#{user.discriminator}", True),
+            ("Moderator", f"{moderator.mention} (`{moderator.id}`)\n{moderator.name}#{moderator.discriminator}", True),
+            ("Punishment ID", f"`{punishment_id}`", True),
+            *((("Duration", duration, True),) if duration else ()),
+            ("Reason", reason, False)
+        )
+        return _build_embed(
+            self._MODLOG_TITLE_PREFIX + action_type.upper(),
+            discord.Color.red(),
+            timestamp or datetime.now(timezone.utc),
+            fields,
+            footer={"text": f"Guild ID: {guild.id}"},
+            thumbnail_url=user.avatar.url if user.avatar else None
+        )
+
+    async def _finish_punishment(self, ctx: discord.ApplicationContext, member: discord.Member, punishment_id: str, action_type: str, reason: str, confirm_embed: discord.Embed, now: datetime, duration: str = None) -> None:
+        log_result, mod_log_result, guild_result, respond_result = await asyncio.gather(
+            self._log_punishment(punishment_id=punishment_id, guild_id=ctx.guild.id, user_id=member.id, moderator_id=ctx.author.id, action_type=action_type, reason=reason),
+            self._send_mod_log(guild=ctx.guild, punishment_id=punishment_id, action_type=action_type, user=member, moderator=ctx.author, reason=reason, duration=duration, timestamp=now),
+            self.db.run(self.db.ensure_guild, ctx.guild.id),
+            ctx.respond(embed=confirm_embed),
+            return_exceptions=True
+        )
+
+        if log_result is not True:
+            logger.error(f"Failed to log punishment {punishment_id} to database: {log_result}")
+        if isinstance(mod_log_result, Exception):
+            logger.error(f"Failed to send mod log for punishment {punishment_id}: {mod_log_result}")
+        if isinstance(guild_result, Exception):
+            logger.error(f"Failed to ensure guild row for guild {ctx.guild.id}: {guild_result}")
+        if isinstance(respond_result, Exception):
+            logger.error(f"Failed to confirm punishment {punishment_id}: {respond_result}")
+
+    @asynccontextmanager
+    async def _member_lock(self, guild_id: int, user_id: int):
+        key = (guild_id, user_id)
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def _parse_duration(self, duration: int, unit: str) -> timedelta:
+        seconds = _UNIT_SECONDS.get(unit)
+        return timedelta(seconds=duration * seconds) if seconds else None
 
     def _format_duration(self, duration: int, unit: str) -> str:
-        if duration == 1:
-            unit = unit.rstrip('s')
+        if duration == 1 and unit.endswith('s'):
+            unit = unit[:-1]
         return f"{duration} {unit}"
 
     mod = SlashCommandGroup("mod", "Moderation Commands")
@@ -114,74 +249,49 @@ class Moderation(commands.Cog):
     @commands.bot_has_permissions(ban_members=True)
     async def ban(self, ctx: discord.ApplicationContext, member: Option(discord.Member, description="The member you want to ban", required=True), reason: Option(str, description="Reason for the ban", required=False, default="No reason provided"), delete_messages: Option(int, description="Delete messages from the last X days (0-7)", required=False, default=0, min_value=0, max_value=7)): # type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
 
-        if member.id == ctx.guild.owner_id:
-            await ctx.respond("You cannot ban the server owner!", ephemeral=True)
-            return
-        
-        if member.id == ctx.author.id:
-            await ctx.respond("You cannot ban yourself!", ephemeral=True)
-            return
-        
-        if member.id == self.bot.user.id:
-            await ctx.respond("I cannot ban myself!", ephemeral=True)
+        if (error := _precheck(ctx, member, self.bot, "ban")):
+            await ctx.respond(error, ephemeral=True)
             return
         
-        if ctx.author.id != ctx.guild.owner_id:
-            if member.top_role >= ctx.author.top_role:
-                await ctx.respond("You cannot ban someone with a higher or equal role!", ephemeral=True)
+        async with self._member_lock(ctx.guild.id, member.id):
+            if ctx.guild.get_member(member.id) is None:
+                await ctx.respond("This member is no longer in the server!", ephemeral=True)
                 return
-            
-        if member.top_role >= ctx.guild.me.top_role:
-            await ctx.respond("I cannot ban someone with a higher or equal role than me!", ephemeral=True)
-            return
-        
-        punishment_id = self._generate_punishment_id()
 
-        try:
-            dm_embed = discord.Embed(title=f"You have been banned from {ctx.guild.name}", color=discord.Color.red(), timestamp=datetime.utcnow())
-            dm_embed.add_field(name="Reason", value=reason, inline=False)
-            dm_embed.add_field(name="Punishment ID", value=f"`{punishment_id}`", inline=False)
-            dm_embed.set_footer(text="If you believe this was a mistake, please contact the server moderators.")
-
-            await member.send(embed=dm_embed)
-            dm_sent = True
-        except (discord.Forbidden, discord.HTTPException):
-            dm_sent = False
-            logger.info(f"Could not DM user {member.id} about their ban")
-        
-        try:
-            await ctx.guild.ban(member, reason=f"[{punishment_id}] {reason} | Banned by {ctx.author}", delete_message_seconds=delete_messages * 86400)
-        except discord.Forbidden:
-            await ctx.respond("I don't have permission to ban this user!", ephemeral=True)
-            return
-        except discord.HTTPException as e:
-            await ctx.respond(f"Failed to ban user: {e}", ephemeral=True)
-            logger.error(f"Failed to ban user {member.id}: {e}")
-            return
-        
-        log_success = self._log_punishment(punishment_id=punishment_id, guild_id=ctx.guild.id, user_id=member.id, moderator_id=ctx.author.id, action_type="BAN", reason=reason)
+            punishment_id = self._generate_punishment_id()
 
-        if not log_success:
-            logger.error(f"Failed to log punishment {punishment_id} to database")
-        
-        await self._send_mod_log(guild=ctx.guild, punishment_id=punishment_id, action_type="BAN", user=member, moderator=ctx.author, reason=reason)
+            try:
+                dm_embed = _build_embed(f"You have been banned from {ctx.guild.name}", discord.Color.red(), now, (
+                    ("Reason", reason, False),
+                    ("Punishment ID", f"`{punishment_id}`", False)
+                ), footer=self._APPEAL_FOOTER)
 
-        guild_check = self.db.fetch_one("SELECT id FROM guilds where guild_id = %s", (ctx.guild.id,))
-        if not guild_check:
-            self.db.insert("guilds", {"guild_id": ctx.guild.id})
+                await member.send(embed=dm_embed)
+                dm_sent = True
+            except (discord.Forbidden, discord.HTTPException):
+                dm_sent = False
+                logger.info(f"Could not DM user {member.id} about their ban")
         
-        confirm_embed = discord.Embed(title="Member Banned", color=discord.Color.green(), timestamp=datetime.utcnow())
-        confirm_embed.add_field(name="User", value=f"{member.mention} (`{member.id}`)", inline=True)
-        confirm_embed.add_field(name="Punishment ID", value=f"`{punishment_id}`", inline=True)
-        confirm_embed.add_field(name="Reason", value=reason, inline=False)
-        if dm_sent:
-            confirm_embed.set_footer(text="User was notified via DM")
-        else:
-            confirm_embed.set_footer(text="Could not notify user via DM")
+            try:
+                await ctx.guild.ban(member, reason=f"[{punishment_id}] {reason} | Banned by {ctx.author}", delete_message_seconds=delete_messages * 86400)
+            except discord.Forbidden:
+                await ctx.respond("I don't have permission to ban this user!", ephemeral=True)
+                return
+            except discord.HTTPException as e:
+                await ctx.respond(f"Failed to ban user: {e}", ephemeral=True)
+                logger.error(f"Failed to ban user {member.id}: {e}")
+                return
         
-        await ctx.respond(embed=confirm_embed)
-        logger.info(f"User {member.id} banned from guild {ctx.guild.id} by {ctx.author.id} - ID: {punishment_id}")
+            confirm_embed = _build_embed("Member Banned", discord.Color.green(), now, (
+                ("User", f"{member.mention} (`{member.id}`)", True),
+                ("Punishment ID", f"`{punishment_id}`", True),
+                ("Reason", reason, False)
+            ), footer=self._DM_SENT_FOOTER if dm_sent else self._DM_FAILED_FOOTER)
+        
+            await self._finish_punishment(ctx, member, punishment_id, "BAN", reason, confirm_embed, now)
+            logger.info(f"User {member.id} banned from guild {ctx.guild.id} by {ctx.author.id} - ID: {punishment_id}")
 
     @ban.error
     async def ban_error(self, ctx: discord.ApplicationContext, error):
@@ -198,73 +308,48 @@ class Moderation(commands.Cog):
     @commands.bot_has_permissions(kick_members=True)
     async def kick(self, ctx : discord.ApplicationContext, member: Option(discord.Member, description="The member you want to kick.", required=True), reason: Option(str, description="Reason for the kick.", required=False, default="No reason provided.")): # type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
 
-        if member.id == ctx.guild.owner_id:
-            await ctx.respond("You cannot kick the server owner!", ephemeral=True)
-            return
-        
-        if member.id == ctx.author.id:
-            await ctx.respond("You cannot kick yourself!", ephemeral=True)
+        if (error := _precheck(ctx, member, self.bot, "kick")):
+            await ctx.respond(error, ephemeral=True)
             return
         
-        if member.id == self.bot.user.id:
-            await ctx.respond("I cannot kick myself!", ephemeral=True)
-
-        if ctx.author.id != ctx.guild.owner_id:
-            if member.top_role >= ctx.author.top_role:
-                await ctx.respond("You cannot kick someone with a higher or equal role!", ephemeral=True)
+        async with self._member_lock(ctx.guild.id, member.id):
+            if ctx.guild.get_member(member.id) is None:
+                await ctx.respond("This member is no longer in the server!", ephemeral=True)
                 return
-            
-        if member.top_role >= ctx.guild.me.top_role:
-            await ctx.respond("I cannot kick someone with a higher or equal role than me!", ephemeral=True)
-            return
-        
-        punishment_id = self._generate_punishment_id()
-
-        try:
-            dm_embed = discord.Embed(title=f"You have been kicked from {ctx.guild.name}", color=discord.Color.orange(), timestamp=datetime.utcnow())
-            dm_embed.add_field(name="Reason", value=reason, inline=False)
-            dm_embed.add_field(name="Punishment ID", value=f"`{punishment_id}`", inline=False)
-            dm_embed.set_footer(text="If you believe this was a mistake, please contact the server moderators.")
-            await member.send(embed=dm_embed)
-            dm_sent = True
-        except (discord.Forbidden, discord.HTTPException):
-            dm_sent = False
-            logger.info(f"Could not DM user {member.id} about their kick.")
-
-        try:
-            await ctx.guild.kick(member, reason=f"[{punishment_id}] {reason} | Kicked by {ctx.author}")
-        except discord.Forbidden:
-            await ctx.respond("I don't have permission to kick this user!", ephemeral=True)
-            return
-        except discord.HTTPException as e:
-            await ctx.respond(f"Failed to kick user: {e}", ephemeral=True)
-            logger.error(f"Failed to kick user {member.id}: {e}")
-            return
-        
-        log_success = self._log_punishment(punishment_id=punishment_id, guild_id=ctx.guild.id, user_id=member.id, moderator_id=ctx.author.id, action_type="KICK", reason=reason)
-
-        if not log_success:
-            logger.error(f"Failed to log punishment {punishment_id} to database.")
 
-        await self._send_mod_log(guild=ctx.guild, punishment_id=punishment_id, action_type="KICK", user=member, moderator=ctx.author, reason=reason)
-
-        guild_check = self.db.fetch_one("SELECT id FROM guilds WHERE guild_id = %s", (ctx.guild.id,))
-        if not guild_check:
-            self.db.insert("guilds", {"guild_id": ctx.guild.id})
+            punishment_id = self._generate_punishment_id()
+
+            try:
+                dm_embed = _build_embed(f"You have been kicked from {ctx.guild.name}", discord.Color.orange(), now, (
+                    ("Reason", reason, False),
+                    ("Punishment ID", f"`{punishment_id}`", False)
+                ), footer=self._APPEAL_FOOTER)
+                await member.send(embed=dm_embed)
+                dm_sent = True
+            except (discord.Forbidden, discord.HTTPException):
+                dm_sent = False
+                logger.info(f"Could not DM user {member.id} about their kick.")
+
+            try:
+                await ctx.guild.kick(member, reason=f"[{punishment_id}] {reason} | Kicked by {ctx.author}")
+            except discord.Forbidden:
+                await ctx.respond("I don't have permission to kick this user!", ephemeral=True)
+                return
+            except discord.HTTPException as e:
+                await ctx.respond(f"Failed to kick user: {e}", ephemeral=True)
+                logger.error(f"Failed to kick user {member.id}: {e}")
+                return
         
-        confirm_embed = discord.Embed(title="Member Kicked", color=discord.Color.green(), timestamp=datetime.utcnow())
-        confirm_embed.add_field(name="User", value=f"{member.mention} (`{member.id}`)", inline=True)
-        confirm_embed.add_field(name="Punishment ID", value=f"`{punishment_id}`", inline=True)
-        confirm_embed.add_field(name="Reason", value=reason, inline=False)
-
-        if dm_sent:
-            confirm_embed.set_footer(text="User was notified via DM")
-        else:
-            confirm_embed.set_footer(text="Could not notify user via DM")
-
-        await ctx.respond(embed=confirm_embed)
-        logger.info(f"User {member. id} kicked from guild {ctx. guild.id} by {ctx. author.id} - ID: {punishment_id}")
+            confirm_embed = _build_embed("Member Kicked", discord.Color.green(), now, (
+                ("User", f"{member.mention} (`{member.id}`)", True),
+                ("Punishment ID", f"`{punishment_id}`", True),
+                ("Reason", reason, False)
+            ), footer=self._DM_SENT_FOOTER if dm_sent else self._DM_FAILED_FOOTER)
+
+            await self._finish_punishment(ctx, member, punishment_id, "KICK", reason, confirm_embed, now)
+            logger.info(f"User {member. id} kicked from guild {ctx. guild.id} by {ctx. author.id} - ID: {punishment_id}")
     
     @kick.error
     async def kick_error(self, ctx: discord.ApplicationContext, error):
@@ -281,26 +366,10 @@ class Moderation(commands.Cog):
     @commands.bot_has_permissions(moderate_members=True)
     async def timeout(self, ctx : discord.ApplicationContext, member : Option(discord.Member, description="The member you want to timeout.", required=True), duration: Option(int, description="Duration of the timeout", required=True, min_value=1, max_value=40320), unit: Option(str, description="Time unit", required=True, choices=["minutes", "hours", "days", "weeks"]), reason : Option(str, description="Reason for the timeout", required=False, default="No reason provided.")): # type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
 
-        if member.id == ctx.guild.owner_id:
-            await ctx.respond("You cannot timeout the server owner!", ephemeral=True)
-            return
-        
-        if member.id == ctx.author.id:
-            await ctx.respond("You cannot timeout yourself!", ephemeral=True)
-            return
-        
-        if member.id == self.bot.user.id:
-            await ctx.respond("I cannot timeout myself!", ephemeral=True)
-            return
-        
-        if ctx.author.id != ctx.guild.owner_id:
-            if member.top_role >= ctx.author.top_role:
-                await ctx.respond("You cannot timeout someone with a higher or equal role!", ephemeral=True)
-                return
-
-        if member.top_role >= ctx.guild.me.top_role:
-            await ctx.respond("I cannot timeout someone with a higher or equal role than me!", ephemeral=True)
+        if (error := _precheck(ctx, member, self.bot, "timeout")):
+            await ctx.respond(error, ephemeral=True)
             return
         
         duration_delta = self._parse_duration(duration, unit)
@@ -313,60 +382,52 @@ class Moderation(commands.Cog):
             await ctx.respond("Timeout duration cannot exceed 28 days!", ephemeral=True)
             return
         
-        timeout_until = datetime.utcnow() + duration_delta
-
-        punishment_id = self._generate_punishment_id()
-
-        duration_str = self._format_duration(duration, unit)
-
-        try:
-            dm_embed = discord.Embed(title=f"You have been timed out in {ctx.guild.name}", color=discord.Color.yellow(), timestamp=datetime.utcnow())
-            dm_embed.add_field(name="Duration", value=duration_str, inline=False)
-            dm_embed.add_field(name="Reason", value=reason, inline=False)
-            dm_embed.add_field(name="Punishment ID", value=f"`{punishment_id}`", inline=False)
-            dm_embed.add_field(name="Timeout Ends", value=f"<t:{int(timeout_until.timestamp())}:F>", inline=False)
-            dm_embed.set_footer(text="If you believe this was a mistake. please contact the server moderators.")
-
-            await member.send(embed=dm_embed)
-            dm_sent = True
-        except (discord.Forbidden, discord.HTTPException):
-            dm_sent = False
-            logger.info(f"Could not DM user {member.id} about their timeout.")
-        
-        try:
-            await member.timeout_for(duration_delta, reason=f"[{punishment_id}] {reason} | Timed out by {ctx.author}")
-        except discord.Forbidden:
-            await ctx.respond("I don't have permission to timeout this user!", ephemeral=True)
-            return
-        except discord.HTTPException as e:
-            await ctx.respond(f"Failed to timeout user: {e}", ephemeral=True)
-            logger.error(f"Failed to timeout user {member.id}: {e}")
-            return
+        async with self._member_lock(ctx.guild.id, member.id):
+            timeout_until = now + duration_delta
+            timeout_ts = int(timeout_until.timestamp())
+
+            punishment_id = self._generate_punishment_id()
+
+            duration_str = self._format_duration(duration, unit)
+
+            dm_embed = _build_embed(f"You have been timed out in {ctx.guild.name}", discord.Color.yellow(), now, (
+                ("Duration", duration_str, False),
+                ("Reason", reason, False),
+                ("Punishment ID", f"`{punishment_id}`", False),
+                ("Timeout Ends", f"<t:{timeout_ts}:F>", False)
+            ), footer=self._APPEAL_FOOTER)
+
+            # A timed out member still shares the guild, so the DM can race the timeout itself
+            dm_result, timeout_result = await asyncio.gather(
+                member.send(embed=dm_embed),
+                member.timeout_for(duration_delta, reason=f"[{punishment_id}] {reason} | Timed out by {ctx.author}"),
+                return_exceptions=True
+            )
+
+            dm_sent = not isinstance(dm_result, BaseException)
+            if not dm_sent:
+                logger.info(f"Could not DM user {member.id} about their timeout.")
+
+            if isinstance(timeout_result, discord.Forbidden):
+                await ctx.respond("I don't have permission to timeout this user!", ephemeral=True)
+                return
+            if isinstance(timeout_result, discord.HTTPException):
+                await ctx.respond(f"Failed to timeout user: {timeout_result}", ephemeral=True)
+                logger.error(f"Failed to timeout user {member.id}: {timeout_result}")
+                return
+            if isinstance(timeout_result, BaseException):
+                raise timeout_result
         
-        log_success = self._log_punishment(punishment_id=punishment_id, guild_id=ctx.guild.id, user_id=member.id, moderator_id=ctx.author.id, action_type="TIMEOUT", reason=reason, duration=duration_str)
-        if not log_success:
-            logger.error(f"Failed to log punishment {punishment_id} to database.")
-
-        await self._send_mod_log(guild=ctx.guild, punishment_id=punishment_id, action_type="TIMEOUT", user=member, moderator=ctx.author, reason=reason, duration=duration_str)
-
-        guild_check = self.db.fetch_one("SELECT id FROM guilds WHERE guild_id = %s", (ctx.guild.id))
-        if not guild_check:
-            self.db.insert("guilds", {"guild_id": ctx.guild.id})
-
-        confirm_embed = discord.Embed(title="Member Timed Out", color=discord.Color.green(), timestamp=datetime.utcnow())
-        confirm_embed.add_field(name="User", value=f"{member.mention} (`{member.id}`)", inline=True)
-        confirm_embed.add_field(name="Punishment ID", value=f"`{punishment_id}`", inline=True)
-        confirm_embed.add_field(name="Duration", value=duration_str, inline=True)
-        confirm_embed.add_field(name="Timeout Ends", value=f"<t:{int(timeout_until.timestamp())}:F> (<t:{int(timeout_until.timestamp)}:R>)", inline=False)
-        confirm_embed.add_field(name="Reason", value=reason, inline=False)
-
-        if dm_sent:
-            confirm_embed.set_footer(text="User was notified via DM")
-        else:
-            confirm_embed.set_footer(text="Could not notify user via DM")
+            confirm_embed = _build_embed("Member Timed Out", discord.Color.green(), now, (
+                ("User", f"{member.mention} (`{member.id}`)", True),
+                ("Punishment ID", f"`{punishment_id}`", True),
+                ("Duration", duration_str, True),
+                ("Timeout Ends", f"<t:{timeout_ts}:F> (<t:{timeout_ts}:R>)", False),
+                ("Reason", reason, False)
+            ), footer=self._DM_SENT_FOOTER if dm_sent else self._DM_FAILED_FOOTER)
 
-        await ctx.respond(embed=confirm_embed)
-        logger.info(f"User {member.id} timed out in guild {ctx.guild.id} by {ctx.author.id} for {duration_str} - ID: {punishment_id}")
+            await self._finish_punishment(ctx, member, punishment_id, "TIMEOUT", reason, confirm_embed, now, duration=duration_str)
+            logger.info(f"User {member.id} timed out in guild {ctx.guild.id} by {ctx.author.id} for {duration_str} - ID: {punishment_id}")
 
     @timeout.error
     async def timeout_error(self, ctx: discord.ApplicationContext, error):
@@ -384,28 +445,31 @@ class Moderation(commands.Cog):
     @commands.bot_has_permissions(moderate_members=True)
     async def untimeout(self, ctx: discord.ApplicationContext, member : Option(discord.Member, description="The member to remove timeout from", required=True), reason: Option(str, description="Reason for removing the timeout", required=False, default="No reason provided.")): # type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
 
-        if not member.is_timed_out():
-            await ctx.respond("This member is not timed out!", ephemeral=True)
-            return
+        async with self._member_lock(ctx.guild.id, member.id):
+            if not member.is_timed_out():
+                await ctx.respond("This member is not timed out!", ephemeral=True)
+                return
         
-        try:
-            await member.remove_timeout(reason=f"{reason} | Removed by {ctx.author}")
-        except discord.Forbidden:
-            await ctx.respond("I don't have permission to remove timeouts!", ephemeral=True)
-            return
-        except discord.HTTPException as e:
-            await ctx.respond(f"Failed to remove timeout: {e}", ephemeral=True)
-            logger.error(f"Failed to remove timeout from user {member.id}: {e}")
-            return
+            try:
+                await member.remove_timeout(reason=f"{reason} | Removed by {ctx.author}")
+            except discord.Forbidden:
+                await ctx.respond("I don't have permission to remove timeouts!", ephemeral=True)
+                return
+            except discord.HTTPException as e:
+                await ctx.respond(f"Failed to remove timeout: {e}", ephemeral=True)
+                logger.error(f"Failed to remove timeout from user {member.id}: {e}")
+                return
         
-        confirm_embed = discord.Embed(title="Timeout Removed", color=discord.Color.green(), timestamp=datetime.utcnow())
-        confirm_embed.add_field(name="User", value=f"{member.mention} (`{member.id}`)", inline=True)
-        confirm_embed.add_field(name="Moderator", value=f"{ctx.author.mention}", inline=True)
-        confirm_embed.add_field(name="Reason", value=reason, inline=False)
-
-        await ctx.respond(embed=confirm_embed)
-        logger.info(f"Timeout removed from user {member.id} in guild {ctx.guild.id} by {ctx.author.id}")
+            confirm_embed = _build_embed("Timeout Removed", discord.Color.green(), now, (
+                ("User", f"{member.mention} (`{member.id}`)", True),
+                ("Moderator", f"{ctx.author.mention}", True),
+                ("Reason", reason, False)
+            ))
+
+            await ctx.respond(embed=confirm_embed)
+            logger.info(f"Timeout removed from user {member.id} in guild {ctx.guild.id} by {ctx.author.id}")
     
     @untimeout.error
     async def untimeout_error(self, ctx : discord.ApplicationContext, error):
@@ -1,20 +1,59 @@
 import discord
 from discord.ext import commands, tasks
 from discord.commands import SlashCommandGroup, Option
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import asyncio
+import heapq
+from operator import itemgetter
+import time
 import logging
-from utils.mysql_helper import MySQLHelper
-from config import MYSQL_CONFIG
+from typing import Optional
+from utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+TEMP_ROLE_CACHE_SIZE = 10_000
+TEMP_ROLE_CACHE_TTL = 60
+EXPIRY_HEAP_LIMIT = 10_000
+EXPIRY_RESYNC_INTERVAL = 900
+EXPIRY_RETRY_DELAY = 60
+EXPIRY_BATCH_SIZE = 500
+EXPIRY_TICK_BUDGET = 10
+
+ROLE_FIELD_LIMIT = 1024
+
+_UNIT_SECONDS = {"minutes": 60, "hours": 3600, "days": 86400, "weeks": 604800}
+
+
+def _validate_role_op(ctx: discord.ApplicationContext, member: discord.Member, role: discord.Role, must_have: bool) -> Optional[str]:
+    verb = "remove" if must_have else "assign"
+    has_role = member.get_role(role.id) is not None
+    if must_have and not has_role:
+        return f"{member.mention} doesn't have the {role.mention} role!"
+    if has_role and not must_have:
+        return f"{member.mention} already has the {role.mention} role!"
+    if role >= ctx.guild.me.top_role:
+        return f"I cannot {verb} {role.mention} because it's higher than or equal to my highest role!"
+    if ctx.author.id != ctx.guild.owner_id and role >= ctx.author.top_role:
+        return f"You cannot {verb} {role.mention} because it's higher than or equal to your highest role!"
+    if role.id == ctx.guild.id:
+        return f"You cannot {verb} the `@everyone` role!"
+    return None
+
 
 class RoleManagement(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db = MySQLHelper(**MYSQL_CONFIG)
+        self.db = bot.db
+        self._temp_role_cache = TTLCache(maxsize=TEMP_ROLE_CACHE_SIZE, ttl=TEMP_ROLE_CACHE_TTL)
+        self._expiry_heap = []
+        self._expiry_wakeup = asyncio.Event()
+        self._next_resync = 0.0
         self._ensure_tables()
-        self.check_temp_Roles.start()
+        self.check_temp_roles.start()
+
+    def cog_unload(self):
+        self.check_temp_roles.cancel()
 
     def _ensure_tables(self):
         create_temp_roles_table = """
@@ -27,13 +66,12 @@ class RoleManagement(commands.Cog):
                 expires_at TIMESTAMP NOT NULL,
                 reason TEXT DEFAULT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                INDEX idx_guild_id (guild_id),
                 INDEX idx_user_id (user_id),
                 INDEX idx_expires_at (expires_at),
-                INDEX idx_guild_user (guild_id, user_id)
+                INDEX idx_guild_user_expires (guild_id, user_id, expires_at)
             )
         """
-        self. db.create_table(create_temp_roles_table)
+        self.db.create_table(create_temp_roles_table)
         
         create_assignments_table = """
             CREATE TABLE IF NOT EXISTS role_assignments (
@@ -47,44 +85,60 @@ class RoleManagement(commands.Cog):
                 is_temporary BOOLEAN DEFAULT FALSE,
                 duration VARCHAR(50) DEFAULT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                INDEX idx_guild_id (guild_id),
                 INDEX idx_user_id (user_id),
-                INDEX idx_role_id (role_id)
+                INDEX idx_role_id (role_id),
+                INDEX idx_guild_user_created (guild_id, user_id, created_at DESC)
             )
         """
         self.db.create_table(create_assignments_table)
+
+        self._migrate_indexes()
         
         logger.info("Role management tables ensured")
     
+    def _migrate_indexes(self):
+        migrations = (
+            ("temp_roles", "idx_guild_user_expires", "CREATE INDEX idx_guild_user_expires ON temp_roles (guild_id, user_id, expires_at)", ("idx_guild_user", "idx_guild_id")),
+            ("role_assignments", "idx_guild_user_created", "CREATE INDEX idx_guild_user_created ON role_assignments (guild_id, user_id, created_at DESC)", ("idx_guild_id",))
+        )
+
+        for table, index_name, create_index, redundant in migrations:
+            if not self.db.index_exists(table, index_name):
+                self.db.execute_query(create_index)
+            for old_index in redundant:
+                if self.db.index_exists(table, old_index):
+                    self.db.execute_query(f"DROP INDEX {old_index} ON {table}")
+
     def _parse_duration(self, duration: int, unit: str) -> timedelta:
-        unit_mapping = {
-            "minutes": timedelta(minutes=duration),
-            "hours": timedelta(hours=duration),
-            "days": timedelta(days=duration),
-            "weeks": timedelta(weeks=duration)
-        }
-        return unit_mapping.get(unit)
+        seconds = _UNIT_SECONDS.get(unit)
+        return timedelta(seconds=duration * seconds) if seconds else None
 
     def _format_duration(self, duration: int, unit: str) -> str:
-        if duration == 1:
-            unit = unit.rstrip('s')
+        if duration == 1 and unit.endswith('s'):
+            unit = unit[:-1]
         return f"{duration} {unit}"
 
-    def _add_temp_role(self, guild_id: int, user_id: int, role_id: int, added_by: int, expires_at: datetime, reason: str = None) -> bool:
+    async def _add_temp_role(self, guild_id: int, user_id: int, role_id: int, added_by: int, expires_at: datetime, reason: str = None) -> bool:
         data = {
             "guild_id": guild_id,
             "user_id": user_id,
             "role_id": role_id,
             "added_by": added_by,
-            "expires_at": expires_at,
+            "expires_at": expires_at.replace(tzinfo=None),
             "reason": reason
         }
-        return self.db.insert("temp_roles", data) is not None
+        result = await self.db.run(self.db.insert, "temp_roles", data)
+        self._temp_role_cache.pop((guild_id, user_id))
+        if result is not None:
+            self._schedule_expiry(expires_at.timestamp())
+        return result is not None
     
-    def _remove_temp_role(self, guild_id: int, user_id: int, role_id: int) -> bool:
-        return self.db.delete("temp_roles", "guild_id = %s AND user_id = %s AND role_id = %s", (guild_id, user_id, role_id))
+    async def _remove_temp_role(self, guild_id: int, user_id: int, role_id: int) -> bool:
+        result = await self.db.run(self.db.delete, "temp_roles", "guild_id = %s AND user_id = %s AND role_id = %s", (guild_id, user_id, role_id))
+        self._temp_role_cache.pop((guild_id, user_id))
+        return result
 
-    def _log_role_assignment(self, guild_id: int, user_id: int, role_id: int, moderator_id: int, action_type: str, reason: str = None, is_temporary: bool = False, duration: str = None) -> bool:
+    async def _log_role_assignment(self, guild_id: int, user_id: int, role_id: int, moderator_id: int, action_type: str, reason: str = None, is_temporary: bool = False, duration: str = None) -> bool:
         data = {
             "guild_id": guild_id,
             "user_id": user_id,
@@ -95,53 +149,154 @@ class RoleManagement(commands.Cog):
             "is_temporary": is_temporary,
             "duration": duration
         }
-        return self.db.insert("role_assignments", data) is not None
+        return await self.db.run(self.db.insert, "role_assignments", data) is not None
     
-    def _get_user_temp_roles(self, guild_id: int, user_id: int) -> list:
+    async def _remove_temp_roles_bulk(self, guild_id: int, user_id: int, role_ids: list) -> bool:
+        if not role_ids:
+            return True
+        placeholders = ", ".join(["%s"] * len(role_ids))
+        result = await self.db.run(self.db.delete, "temp_roles", f"guild_id = %s AND user_id = %s AND role_id IN ({placeholders})", (guild_id, user_id, *role_ids))
+        self._temp_role_cache.pop((guild_id, user_id))
+        return result
+
+    async def _log_role_assignments_bulk(self, rows: list) -> bool:
+        return await self.db.run(self.db.insert_many, "role_assignments", rows)
+
+    async def _get_user_temp_roles(self, guild_id: int, user_id: int) -> list:
+        cached = self._temp_role_cache.get((guild_id, user_id))
+        if cached is not None:
+            return cached
+
         query = """
-            SELECT role_id, expires_at, reason, added_by
+            SELECT role_id, UNIX_TIMESTAMP(expires_at) AS expires_ts, reason, added_by
             FROM temp_roles
             WHERE guild_id = %s AND user_id = %s
             ORDER BY expires_at ASC
         """
-        return self.db.fetch_all_dict(query, (guild_id, user_id))
+        temp_roles = await self.db.run(self.db.fetch_all_dict, query, (guild_id, user_id))
+        self._temp_role_cache.set((guild_id, user_id), temp_roles)
+        return temp_roles
 
-    def _get_expired_temp_roles(self) -> list:
+    async def _get_expired_temp_roles(self, now: datetime, after_id: int = 0) -> list:
         query = """
             SELECT id, guild_id, user_id, role_id
             FROM temp_roles
-            WHERE expires_at <= NOW()
+            WHERE expires_at <= %s AND id > %s
+            ORDER BY id
+            LIMIT %s
         """
-        return self.db.fetch_all_dict(query)
-    
-    @tasks.loop(seconds=30)
-    async def check_temp_roles(self):
-        expired_roles = self._get_expired_temp_roles()
-
-        for entry in expired_roles:
-            guild = self.bot.get_guild(entry["guild_id"])
-            if not guild:
-                self.db.delete("temp_rolees", "id = %s", (entry["id"]))
-                continue
+        return await self.db.run(self.db.fetch_all_dict, query, (now, after_id, EXPIRY_BATCH_SIZE))
 
+    async def _load_expiry_heap(self) -> None:
+        query = """
+            SELECT UNIX_TIMESTAMP(expires_at)
+            FROM temp_roles
+            ORDER BY expires_at ASC
+            LIMIT %s
+        """
+        rows = await self.db.run(self.db.fetch_all, query, (EXPIRY_HEAP_LIMIT,))
+        self._expiry_heap = [row[0] for row in rows]
+        heapq.heapify(self._expiry_heap)
+        self._next_resync = time.monotonic() + EXPIRY_RESYNC_INTERVAL
+
+    def _schedule_expiry(self, expires_ts: float) -> None:
+        if not self._expiry_heap or expires_ts < self._expiry_heap[0]:
+            self._expiry_wakeup.set()
+        heapq.heappush(self._expiry_heap, expires_ts)
+    
+    async def _delete_temp_roles_by_id(self, ids: list) -> bool:
+        if not ids:
+            return True
+        placeholders = ", ".join(["%s"] * len(ids))
+        return await self.db.run(self.db.delete, "temp_roles", f"id IN ({placeholders})", tuple(ids))
+
+    async def _process_guild_expirations(self, guild_id: int, entries: list) -> list:
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            return [entry["id"] for entry in entries]
+
+        processed_ids = []
+        for entry in entries:
             member = guild.get_member(entry["user_id"])
             if not member:
-                self.db.delete("temp_roles", "id = %s", (entry["id"]))
+                processed_ids.append(entry["id"])
                 continue
 
             role = guild.get_role(entry["role_id"])
             if not role:
-                self.db.delete("temp_roles", "id = %s", (entry["id"]))
+                processed_ids.append(entry["id"])
                 continue
 
             try:
                 await member.remove_roles(role, reason="Temporary role expired")
-                self.db.delete("temp_roles", "id = %s", (entry["id"]))
+                processed_ids.append(entry["id"])
                 logger.info(f"Removed expired temp role {role.name} from {member} in {guild.name}")
             except discord.Forbidden:
                 logger.warning(f"Missing permissions to remove role {role.name} from {member} in {guild.name}")
             except Exception as e:
                 logger.error(f"Error removing expired temp role: {e}")
+
+        return processed_ids
+
+    @tasks.loop(seconds=0)
+    async def check_temp_roles(self):
+        if time.monotonic() >= self._next_resync:
+            await self._load_expiry_heap()
+
+        timeout = self._next_resync - time.monotonic()
+        if self._expiry_heap:
+            timeout = min(timeout, self._expiry_heap[0] - time.time())
+
+        if timeout > 0:
+            self._expiry_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._expiry_wakeup.wait(), timeout)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+        now = time.time()
+        if not self._expiry_heap or self._expiry_heap[0] > now:
+            return
+        while self._expiry_heap and self._expiry_heap[0] <= now:
+            heapq.heappop(self._expiry_heap)
+
+        await self._expire_due_temp_roles()
+
+    async def _expire_due_temp_roles(self) -> None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        deadline = time.monotonic() + EXPIRY_TICK_BUDGET
+        after_id = 0
+        failed = False
+
+        while True:
+            expired_roles = await self._get_expired_temp_roles(now, after_id)
+            if not expired_roles:
+                break
+
+            by_guild = {}
+            for entry in expired_roles:
+                by_guild.setdefault(entry["guild_id"], []).append(entry)
+
+            results = await asyncio.gather(*(self._process_guild_expirations(guild_id, entries) for guild_id, entries in by_guild.items()))
+            processed_ids = [entry_id for processed_ids in results for entry_id in processed_ids]
+            await self._delete_temp_roles_by_id(processed_ids)
+
+            for entry in expired_roles:
+                self._temp_role_cache.pop((entry["guild_id"], entry["user_id"]))
+
+            failed = failed or len(processed_ids) < len(expired_roles)
+            after_id = expired_roles[-1]["id"]
+
+            if len(expired_roles) < EXPIRY_BATCH_SIZE:
+                break
+            if time.monotonic() >= deadline:
+                # Yield to the scheduler and pick up the remaining rows on the next iteration
+                self._schedule_expiry(time.time())
+                break
+
+        if failed:
+            self._schedule_expiry(time.time() + EXPIRY_RETRY_DELAY)
     
     @check_temp_roles.before_loop
     async def before_check_temp_roles(self):
@@ -154,21 +309,9 @@ class RoleManagement(commands.Cog):
     @commands.bot_has_guild_permissions(manage_roles=True)
     async def add_role(self, ctx: discord.ApplicationContext, member: Option(discord.Member, description="The member to give the role to", required=True), role: Option(discord.Role, description="The role to give", required=True), reason: Option(str, description="Reason for adding the role", required=False, default="No reason provided")): #type: ignore
         await ctx.defer()
-        if role in member.roles:
-            await ctx.respond(f"{member.mention} already has the {role.mention} role!", ephemeral=True)
-            return
-        
-        if role >= ctx.guild.me.top_role:
-            await ctx.respond(f"I cannot assign {role.mention} because it's higher than or equal to my highest role!", ephemeral=True)
-            return
-        
-        if ctx.author.id != ctx.guild.owner_id:
-            if role >= ctx.author.top_role:
-                await ctx.respond(f"You cannot assign {role.mention} because it's higher than or equal to your highest role!", ephemeral=True)
-                return
-        
-        if role.is_default():
-            await ctx.respond("You cannot assign the `@everyone` role!", ephemeral=True)
+        now = datetime.now(timezone.utc)
+        if (error := _validate_role_op(ctx, member, role, must_have=False)):
+            await ctx.respond(error, ephemeral=True)
             return
         
         try:
@@ -181,9 +324,9 @@ class RoleManagement(commands.Cog):
             logger.error(f"Failed to add role {role.id} to {member.id}: {e}")
             return
         
-        self._log_role_assignment(guild_id=ctx.guild.id, user_id=member.id, role_id=role.id, moderator_id=ctx.author.id, action_type="ADD", reason=reason, is_temporary=False)
+        await self._log_role_assignment(guild_id=ctx.guild.id, user_id=member.id, role_id=role.id, moderator_id=ctx.author.id, action_type="ADD", reason=reason, is_temporary=False)
 
-        embed = discord.Embed(title="Role Added", color=discord.Color.green(), timestamp=datetime.utcnow())
+        embed = discord.Embed(title="Role Added", color=discord.Color.green(), timestamp=now)
         embed.add_field(name="Member", value=f"{member.mention}", inline=True)
         embed.add_field(name="Role", value=f"{role.mention}", inline=True)
         embed.add_field(name="Moderator", value=f"{ctx.author.mention}", inline=True)
@@ -197,22 +340,10 @@ class RoleManagement(commands.Cog):
     @commands.bot_has_guild_permissions(manage_roles=True)
     async def remove_role(self, ctx: discord.ApplicationContext, member: Option(discord.Member, description="The member to remove the role from", required=True), role: Option(discord.Role, description="The role to remove", required=True), reason: Option(str, description="Reason for removing the role", required=False, default="No reason provided")): #type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
 
-        if role not in member.roles:
-            await ctx.respond(f"{member.mention} doesn't have the {role.mention} role!", ephemeral=True)
-            return
-        
-        if role >= ctx.guild.me.top_role:
-            await ctx.respond(f"I cannot remove {role.mention} because it's higher than or equal to my highest role!", ephemeral=True)
-            return
-        
-        if ctx.author.id != ctx.guild.owner_id:
-            if role >= ctx.author.top_role:
-                await ctx.respond(f"You cannot remove {role.mention} because it's higher than or equal to your highest role!", ephemeral=True)
-                return
-        
-        if role.is_default():
-            await ctx.respond("You cannot remove the `@everyone` role!", ephemeral=True)
+        if (error := _validate_role_op(ctx, member, role, must_have=True)):
+            await ctx.respond(error, ephemeral=True)
             return
         
         try:
@@ -225,11 +356,11 @@ class RoleManagement(commands.Cog):
             logger.error(f"Failed to remove role {role.id} from {member.id}: {e}")
             return
         
-        self._remove_temp_role(ctx.guild.id, member.id, role.id)
+        await self._remove_temp_role(ctx.guild.id, member.id, role.id)
 
-        self._log_role_assignment(guild_id=ctx.guild.id, user_id=member.id, role_id=role.id, moderator_id=ctx.author.id, action_type="REMOVE", reason=reason, is_temporary=False)
+        await self._log_role_assignment(guild_id=ctx.guild.id, user_id=member.id, role_id=role.id, moderator_id=ctx.author.id, action_type="REMOVE", reason=reason, is_temporary=False)
 
-        embed = discord.Embed(title="Role Removed", color=discord.Color.green(), timestamp=datetime.utcnow())
+        embed = discord.Embed(title="Role Removed", color=discord.Color.green(), timestamp=now)
         embed.add_field(name="Member", value=f"{member.mention}", inline=True)
         embed.add_field(name="Role", value=f"{role.mention}", inline=True)
         embed.add_field(name="Moderator", value=f"{ctx.author.mention}", inline=True)
@@ -243,22 +374,10 @@ class RoleManagement(commands.Cog):
     @commands.bot_has_guild_permissions(manage_roles=True)
     async def temp_role(self, ctx: discord.ApplicationContext, member: Option(discord.Member, description="The member to give the role to", required=True), role: Option(discord.Role, description="The role to give", required=True), duration: Option(int, description="Duration value", required=True, min_value=1, max_value=365), unit: Option(str, description="Time unit", required=True, choices=["minutes", "hours", "days", "weeks"]), reason: Option(str, description="Reason for adding the temproary role", required=False, default="No reason provided")): #type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
 
-        if role in member.roles:
-            await ctx.respond(f"{member.mention} already has the {role.mention} role!", ephemeral=True)
-            return
-        
-        if role >= ctx.guild.me.top_role:
-            await ctx.respond(f"I cannot assign {role.mention} because it's higher than or equal to my highest role!", ephemeral=True)
-            return
-        
-        if ctx.author.id != ctx.guild.owner_id:
-            if role >= ctx.author.top_role:
-                await ctx.respond(f"You cannot assign {role.mention} because it's higher than or equal to your highest role!", ephemeral=True)
-                return
-            
-        if role.is_default():
-            await ctx.respond("You cannot assign the `@everyone` role!", ephemeral=True)
+        if (error := _validate_role_op(ctx, member, role, must_have=False)):
+            await ctx.respond(error, ephemeral=True)
             return
         
         duration_delta = self._parse_duration(duration, unit)
@@ -266,7 +385,7 @@ class RoleManagement(commands.Cog):
             await ctx.respond("Invalid duration unit!", ephemeral=True)
             return
         
-        expires_at = datetime.utcnow() + duration_delta
+        expires_at = now + duration_delta
         duration_str = self._format_duration(duration, unit)
 
         try:
@@ -279,19 +398,20 @@ class RoleManagement(commands.Cog):
             logger.error(f"Failed to add temp role {role.id} to {member.id}: {e}")
             return
         
-        success = self._add_temp_role(guild_id=ctx.guild.id, user_id=member.id, role_id=role.id, added_by=ctx.author.id, expires_at=expires_at, reason=reason)
+        success = await self._add_temp_role(guild_id=ctx.guild.id, user_id=member.id, role_id=role.id, added_by=ctx.author.id, expires_at=expires_at, reason=reason)
 
         if not success:
             logger.error(f"Failed to log temp role to database for {member.id}")
         
-        self._log_role_assignment(guild_id=ctx.guild.id, user_id=member.id, role_id=role.id, moderator_id=ctx.author.id, action_type="ADD", reason=reason, is_temporary=True, duration=duration_str)
+        await self._log_role_assignment(guild_id=ctx.guild.id, user_id=member.id, role_id=role.id, moderator_id=ctx.author.id, action_type="ADD", reason=reason, is_temporary=True, duration=duration_str)
 
-        embed = discord.Embed(title="Temproary Role Added", color = discord.Color.blue(), timestamp=datetime.utcnow())
+        embed = discord.Embed(title="Temproary Role Added", color = discord.Color.blue(), timestamp=now)
         embed.add_field(name="Member", value=f"{member.mention}", inline=True)
         embed.add_field(name="Role", value=f"{role.mention}", inline=True)
         embed.add_field(name="Moderator", value=f"{ctx.author.mention}", inline=True)
         embed.add_field(name="Duration", value=duration_str, inline=True)
-        embed.add_field(name="Expires", value=f"<t:{int(expires_at.timestamp())}:F> (<t:{int(expires_at.timestamp())}:R>)", inline=False)
+        expires_ts = int(expires_at.timestamp())
+        embed.add_field(name="Expires", value=f"<t:{expires_ts}:F> (<t:{expires_ts}:R>)", inline=False)
         embed.add_field(name="Reason", value=reason, inline=False)
 
         await ctx.respond(embed=embed)
@@ -301,37 +421,49 @@ class RoleManagement(commands.Cog):
     @commands.has_guild_permissions(manage_roles=True)
     async def list_roles(self, ctx: discord.ApplicationContext, member: Option(discord.Member, description="The member to list roles for", required=False)): #type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
 
         member = member or ctx.author
 
-        roles = [role for role in member.roles if not role.is_default()]
+        everyone_id = ctx.guild.id
+        roles = [(role.position, role.id, role.mention) for role in member.roles if role.id != everyone_id]
 
         if not roles:
             await ctx.respond(f"{member.mention} has no roles.")
             return
         
-        temp_roles = self._get_user_temp_roles(ctx.guild.id, member.id)
-        temp_role_ids = [tr["role_id"] for tr in temp_roles]
+        temp_roles = await self._get_user_temp_roles(ctx.guild.id, member.id)
+        temp_expiry_by_id = {tr["role_id"]: tr["expires_ts"] for tr in temp_roles}
 
-        embed = discord.Embed(title=f"Roles for {member.display_name}", color=member.color, timestamp=datetime.utcnow())
+        embed = discord.Embed(title=f"Roles for {member.display_name}", color=member.color, timestamp=now)
         
-        roles.sort(key=lambda r: r.position, reverse=True)
+        roles.sort(key=itemgetter(0), reverse=True)
 
         role_list = []
-        for role in roles:
-            if role.id in temp_role_ids:
-                temp_data = next((tr for tr in temp_roles if tr["role_id"] == role.id), None)
-                if temp_data:
-                    expires_str = f" (expires <t:{int(temp_data['expires_at'].timestamp())}:R>)"
-                    role_list.append(f"{role.mention} {expires_str}")
-                else:
-                    role_list.append(f"{role.mention}")
+        text_len = 0
+        for _, role_id, mention in roles:
+            expires_ts = temp_expiry_by_id.get(role_id)
+            if expires_ts is not None:
+                entry = f"{mention}  (expires <t:{expires_ts}:R>)"
             else:
-                role_list.append(role.mention)
+                entry = mention
+            
+            entry_len = len(entry) + 2 if role_list else len(entry)
+            if text_len + entry_len > ROLE_FIELD_LIMIT:
+                break
+            role_list.append(entry)
+            text_len += entry_len
+        
+        # Drop entries until the "+N more" tail fits in the field as well
+        if len(role_list) < len(roles):
+            while role_list:
+                tail = f"... (+{len(roles) - len(role_list)} more)"
+                if text_len + 2 + len(tail) <= ROLE_FIELD_LIMIT:
+                    break
+                text_len -= len(role_list.pop()) + (2 if role_list else 0)
+            role_list.append(f"... (+{len(roles) - len(role_list)} more)")
         
         role_text = ", ".join(role_list)
-        if len(role_text) > 1024:
-            role_text = role_text[:1021] + "..."
         
         embed.add_field(name=f"Roles ({len(roles)})", value=role_text, inline=False)
         embed.set_thumbnail(url=member.display_avatar.url)
@@ -342,10 +474,11 @@ class RoleManagement(commands.Cog):
     @commands.has_permissions(manage_roles=True)
     async def temp_list(self, ctx: discord.ApplicationContext, member: Option(discord.Member, description="The member to list temporary roles for", required=False)): # type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
         
         member = member or ctx.author
         
-        temp_roles = self._get_user_temp_roles(ctx.guild.id, member.id)
+        temp_roles = await self._get_user_temp_roles(ctx.guild.id, member.id)
         
         if not temp_roles: 
             await ctx.respond(f"{member.mention} has no temporary roles.")
@@ -354,18 +487,25 @@ class RoleManagement(commands.Cog):
         embed = discord.Embed(
             title=f"Temporary Roles for {member.display_name}",
             color=discord.Color.blue(),
-            timestamp=datetime.utcnow()
+            timestamp=now
         )
         
+        get_role = ctx.guild.get_role
+        get_member = ctx.guild.get_member
+        added_by_mentions = {}
+        
         for idx, temp_data in enumerate(temp_roles, 1):
-            role = ctx.guild.get_role(temp_data["role_id"])
+            role = get_role(temp_data["role_id"])
             if not role:
                 continue
             
-            added_by = ctx.guild.get_member(temp_data["added_by"])
-            added_by_text = added_by.mention if added_by else "Unknown"
+            added_by_id = temp_data["added_by"]
+            added_by_text = added_by_mentions.get(added_by_id)
+            if added_by_text is None:
+                added_by = get_member(added_by_id)
+                added_by_text = added_by_mentions[added_by_id] = added_by.mention if added_by else "Unknown"
             
-            expires_timestamp = int(temp_data["expires_at"].timestamp())
+            expires_timestamp = temp_data["expires_ts"]
             reason = temp_data["reason"] or "No reason provided"
             
             embed.add_field(
@@ -385,16 +525,17 @@ class RoleManagement(commands.Cog):
     @commands.has_permissions(manage_roles=True)
     async def role_history(self, ctx: discord.ApplicationContext, member: Option(discord.Member, description="The member to view history for", required=True), limit: Option(int, description="Number of entries to show", required=False, default=10, min_value=1, max_value=25)): # type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
         
         query = """
-            SELECT role_id, moderator_id, action_type, reason, is_temporary, duration, created_at
+            SELECT role_id, moderator_id, action_type, reason, is_temporary, duration, UNIX_TIMESTAMP(created_at) AS created_ts
             FROM role_assignments
             WHERE guild_id = %s AND user_id = %s
             ORDER BY created_at DESC
             LIMIT %s
         """
         
-        history = self.db.fetch_all_dict(query, (ctx.guild. id, member.id, limit))
+        history = await self.db.run(self.db.fetch_all_dict, query, (ctx.guild.id, member.id, limit))
         
         if not history: 
             await ctx.respond(f"No role history found for {member.mention}.")
@@ -403,20 +544,31 @@ class RoleManagement(commands.Cog):
         embed = discord.Embed(
             title=f"Role History for {member.display_name}",
             color=discord.Color.blue(),
-            timestamp=datetime.utcnow()
+            timestamp=now
         )
         
+        get_role = ctx.guild.get_role
+        get_member = ctx.guild.get_member
+        role_mentions = {}
+        moderator_mentions = {}
+        
         for idx, entry in enumerate(history, 1):
-            role = ctx.guild. get_role(entry["role_id"])
-            role_text = role.mention if role else f"Deleted Role ({entry['role_id']})"
+            role_id = entry["role_id"]
+            role_text = role_mentions.get(role_id)
+            if role_text is None:
+                role = get_role(role_id)
+                role_text = role_mentions[role_id] = role.mention if role else f"Deleted Role ({role_id})"
             
-            moderator = ctx.guild.get_member(entry["moderator_id"])
-            moderator_text = moderator.mention if moderator else "Unknown"
+            moderator_id = entry["moderator_id"]
+            moderator_text = moderator_mentions.get(moderator_id)
+            if moderator_text is None:
+                moderator = get_member(moderator_id)
+                moderator_text = moderator_mentions[moderator_id] = moderator.mention if moderator else "Unknown"
             
             action_emoji = "➕" if entry["action_type"] == "ADD" else "➖"
             temp_text = f"({entry['duration']})" if entry["is_temporary"] else ""
             
-            timestamp = int(entry["created_at"].timestamp())
+            timestamp = entry["created_ts"]
             reason = entry["reason"] or "No reason provided"
             
             embed.add_field(
@@ -439,23 +591,20 @@ class RoleManagement(commands.Cog):
     @commands.bot_has_permissions(manage_roles=True)
     async def remove_all_roles(self, ctx: discord.ApplicationContext, member: Option(discord.Member, description="The member to remove all roles from", required=True), reason: Option(str, description="Reason for removing all roles", required=False, default="No reason provided")): # type: ignore
         await ctx.defer()
+        now = datetime.now(timezone.utc)
         
-        roles_to_remove = [role for role in member.roles if not role. is_default()]
+        everyone_id = ctx.guild.id
+        roles_to_remove = [role for role in member.roles if role.id != everyone_id]
         
         if not roles_to_remove: 
             await ctx.respond(f"{member.mention} has no roles to remove!", ephemeral=True)
             return
         
-        can_remove = []
-        cannot_remove = []
-        
-        for role in roles_to_remove:
-            if role >= ctx.guild.me.top_role:
-                cannot_remove. append(role)
-            elif ctx.author.id != ctx.guild.owner_id and role >= ctx.author.top_role:
-                cannot_remove. append(role)
-            else:
-                can_remove. append(role)
+        # Anything below this ceiling is removable by both the bot and the author
+        bot_top = ctx.guild.me.top_role
+        ceiling = bot_top if ctx.author.id == ctx.guild.owner_id else min(bot_top, ctx.author.top_role)
+        can_remove = [role for role in roles_to_remove if role < ceiling]
+        cannot_remove = [role for role in roles_to_remove if role >= ceiling]
         
         if not can_remove:
             await ctx.respond("No roles can be removed due to role hierarchy!", ephemeral=True)
@@ -470,23 +619,28 @@ class RoleManagement(commands.Cog):
             await ctx.respond(f"Failed to remove roles:  {e}", ephemeral=True)
             return
         
+        role_ids = []
+        assignments = []
         for role in can_remove:
-            self._remove_temp_role(ctx. guild.id, member.id, role.id)
-        
-        for role in can_remove:
-            self._log_role_assignment(
-                guild_id=ctx.guild.id,
-                user_id=member.id,
-                role_id=role.id,
-                moderator_id=ctx.author.id,
-                action_type="REMOVE",
-                reason=reason
-            )
+            role_ids.append(role.id)
+            assignments.append({
+                "guild_id": ctx.guild.id,
+                "user_id": member.id,
+                "role_id": role.id,
+                "moderator_id": ctx.author.id,
+                "action_type": "REMOVE",
+                "reason": reason,
+                "is_temporary": False,
+                "duration": None
+            })
+
+        await self._remove_temp_roles_bulk(ctx.guild.id, member.id, role_ids)
+        await self._log_role_assignments_bulk(assignments)
         
         embed = discord. Embed(
             title="Roles Removed",
             color=discord.Color.green(),
-            timestamp=datetime.utcnow()
+            timestamp=now
         )
         embed.add_field(name="Member", value=f"{member.mention}", inline=True)
         embed.add_field(name="Moderator", value=f"{ctx. author.mention}", inline=True)
@@ -5,12 +5,112 @@ from datetime import datetime, timezone, timedelta
 from collections import defaultdict, deque
 import re
 import json
+import asyncio
+import functools
+import zlib
 import logging
-from utils.mysql_helper import MySQLHelper
-from config import MYSQL_CONFIG
+from utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+SETTINGS_CACHE_SIZE = 10_000
+SETTINGS_CACHE_TTL = 60
+MESSAGE_LOG_SIZE = 64
+DM_LOG_SIZE = 16
+JOIN_LOG_SIZE = 1000
+ACTION_LOG_SIZE = 64
+TRANSIENT_STATE_TTL = 300
+AUDIT_RETRY_MIN = 5
+AUDIT_RETRY_MAX = 300
+
+RESTORE_BATCH_SIZE = 5
+BACKUP_COMPRESS_LEVEL = 1
+BACKUP_CHUNK_SIZE = 64 * 1024
+
+_EMPTY_WHITELIST = frozenset()
+
+_SQL_GET_SETTINGS = "SELECT * FROM security_settings WHERE guild_id = %s"
+_SQL_INSERT_SETTINGS = "INSERT IGNORE INTO security_settings (guild_id) VALUES (%s)"
+_SQL_GET_WHITELIST = "SELECT user_id FROM security_whitelist WHERE guild_id = %s"
+_SQL_GET_BACKUP = "SELECT backup_data FROM server_backups WHERE guild_id = %s"
+_SQL_SAVE_BACKUP = """
+    INSERT INTO server_backups (guild_id, backup_data)
+    VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE backup_data = VALUES(backup_data), updated_at = CURRENT_TIMESTAMP
+"""
+_SQL_GET_PANIC = "SELECT permissions FROM security_panic_state WHERE guild_id = %s"
+_SQL_SAVE_PANIC = """
+    INSERT INTO security_panic_state (guild_id, permissions)
+    VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE permissions = VALUES(permissions)
+"""
+
+_BACKUP_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+def _iter_backup_json(backup_data: dict):
+    # Lists are written one element at a time so only a single channel or role is ever encoded at once
+    encode = _BACKUP_ENCODER.encode
+    yield "{"
+    for index, (key, value) in enumerate(backup_data.items()):
+        yield f"{',' if index else ''}{encode(key)}:"
+        if isinstance(value, list):
+            yield "["
+            for item_index, item in enumerate(value):
+                yield f"{',' if item_index else ''}{encode(item)}"
+            yield "]"
+        else:
+            yield encode(value)
+    yield "}"
+
+def _compress_backup(backup_data: dict) -> bytes:
+    compressor = zlib.compressobj(BACKUP_COMPRESS_LEVEL)
+    compressed = []
+    pending = []
+    pending_size = 0
+    for chunk in _iter_backup_json(backup_data):
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size >= BACKUP_CHUNK_SIZE:
+            compressed.append(compressor.compress("".join(pending).encode("utf-8")))
+            pending.clear()
+            pending_size = 0
+    compressed.append(compressor.compress("".join(pending).encode("utf-8")))
+    compressed.append(compressor.flush())
+    return b"".join(compressed)
+
+def _decompress_backup(data) -> dict:
+    if isinstance(data, str):
+        return json.loads(data)
+    try:
+        data = zlib.decompress(data)
+    except zlib.error:
+        # Backups written before compression are plain JSON
+        pass
+    return json.loads(data)
+
+def _overwrite_key(channel: discord.abc.GuildChannel) -> tuple:
+    Role = discord.Role
+    return tuple(sorted((target.id, overwrite.send_messages, overwrite.view_channel) for target, overwrite in channel.overwrites.items() if isinstance(target, Role)))
+
+def _resolve_overwrites(role_map: dict, overwrite_data) -> dict:
+    # Templates are [role_id, send_messages, view_channel] rows; older backups stored {"role_id": {...}} maps
+    if isinstance(overwrite_data, dict):
+        overwrite_data = [(int(role_id), perms["send_messages"], perms["view_channel"]) for role_id, perms in overwrite_data.items()]
+
+    overwrites = {}
+    for role_id, send_messages, view_channel in overwrite_data:
+        role = role_map.get(role_id)
+        if role:
+            overwrites[role] = discord.PermissionOverwrite(send_messages=send_messages, view_channel=view_channel)
+    return overwrites
+
+async def _run_batched(calls: list, batch_size: int = RESTORE_BATCH_SIZE) -> list:
+    results = []
+    for start in range(0, len(calls), batch_size):
+        results.extend(await asyncio.gather(*(call() for call in calls[start:start + batch_size]), return_exceptions=True))
+    return results
+
+
 class GiveRolesBackView(discord.ui.View):
     def __init__(self, original_roles, user : discord.Member):
         super().__init__(timeout=None)
@@ -54,9 +154,22 @@ class UndoPunishment(discord.ui.View):
             interaction.response.send_message(f"Failed to undo: {e}", ephemeral=True)
 
 class Security(commands.Cog):
+    NUKE_ACTIONS = {
+        discord.AuditLogAction.ban: "ban",
+        discord.AuditLogAction.kick: "kick",
+        discord.AuditLogAction.channel_delete: "channel_delete",
+        discord.AuditLogAction.role_delete: "role_delete",
+        discord.AuditLogAction.emoji_delete: "emoji_delete"
+    }
+    SUSPICIOUS_LINKS = ("discord.gift", "free-nitro", "steam-giveaway", "airdrop", "login.discord", "discord-app")
+    SELFBOT_PATTERNS = ("@everyone", "http", ":", ".com", "discord.gg")
+    SUSPICIOUS_RE = re.compile("|".join(map(re.escape, SUSPICIOUS_LINKS)), re.IGNORECASE)
+    SELFBOT_RE = re.compile("|".join(map(re.escape, SELFBOT_PATTERNS)), re.IGNORECASE)
+    LINK_RE = re.compile(r"https?://")
+
     def __init__(self, bot):
         self.bot = bot
-        self.db = MySQLHelper(**MYSQL_CONFIG)
+        self.db = bot.db
         self.joins = {}
         self.raid_mode = {}
         self.thresholds = defaultdict(lambda: {
@@ -66,12 +179,26 @@ class Security(commands.Cog):
             "role_delete": (2, 10),
             "emoji_delete": (2, 10)
         })
-        self.action_logs = defaultdict(lambda: defaultdict(deque))
-        self.user_messages = defaultdict(deque)
+        self.action_logs = {}
+        self.user_messages = defaultdict(lambda: deque(maxlen=MESSAGE_LOG_SIZE))
         self.join_times = {}
         self.original_permissions = {}
-        self.dm_tracker = defaultdict(list)
+        self.dm_tracker = defaultdict(lambda: deque(maxlen=DM_LOG_SIZE))
+        self._settings_cache = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_CACHE_TTL)
+        self._whitelist_cache = {}
+        self._log_channel_cache = {}
+        self._audit_cursor = {}
+        self._audit_retry_delay = AUDIT_RETRY_MIN
+        self._audit_restart = None
         self._ensure_tables()
+        self.gc_transient_state.start()
+        self.watch_audit_log.start()
+
+    def cog_unload(self):
+        self.gc_transient_state.cancel()
+        self.watch_audit_log.cancel()
+        if self._audit_restart:
+            self._audit_restart.cancel()
 
     def _ensure_tables(self):
         create_whitelist_table = """
@@ -92,13 +219,15 @@ class Security(commands.Cog):
             CREATE TABLE IF NOT EXISTS server_backups (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 guild_id BIGINT UNIQUE NOT NULL,
-                backup_data LONGTEXT NOT NULL,
+                backup_data LONGBLOB NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
                 INDEX idx_guild_id (guild_id)
             )
         """
         self.db.create_table(create_backup_table)
+        if self.db.column_type("server_backups", "backup_data") == "longtext":
+            self.db.execute_query("ALTER TABLE server_backups MODIFY backup_data LONGBLOB NOT NULL")
         
         create_settings_table = """
             CREATE TABLE IF NOT EXISTS security_settings (
@@ -126,15 +255,27 @@ class Security(commands.Cog):
         """
         self.db.create_table(create_settings_table)
 
+        create_panic_table = """
+            CREATE TABLE IF NOT EXISTS security_panic_state (
+                guild_id BIGINT PRIMARY KEY,
+                permissions LONGTEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """
+        self.db.create_table(create_panic_table)
+
         logger.info("Security tables ensured")
 
-    def _get_security_settings(self, guild_id: int) -> dict:
-        query = "SELECT * FROM security_settings WHERE guild_id = %s"
-        result = self.db.fetch_one_dict(query, (guild_id,))
+    async def _get_security_settings(self, guild_id: int) -> dict:
+        cached = self._settings_cache.get(guild_id)
+        if cached is not None:
+            return cached
+
+        result = await self.db.run(self.db.fetch_one_dict, _SQL_GET_SETTINGS, (guild_id,))
 
         if not result:
-            self.db.insert("security_settings", {"guild_id": guild_id})
-            return {
+            await self.db.run(self.db.execute_query, _SQL_INSERT_SETTINGS, (guild_id,))
+            result = {
                 "security_log_channel_id": None,
                 "anti_raid_enabled": True,
                 "anti_nuke_enabled": True,
@@ -152,57 +293,82 @@ class Security(commands.Cog):
                 "spam_link_threshold": 4 
             }
         
+        self._settings_cache.set(guild_id, result)
         return result
+
+    def invalidate_settings(self, guild_id: int) -> None:
+        self._settings_cache.pop(guild_id)
+        self._log_channel_cache.pop(guild_id, None)
     
-    def _get_security_log_channel(self, guild_id: int) -> int:
-        settings = self._get_security_settings(guild_id)
+    async def _get_security_log_channel(self, guild_id: int) -> int:
+        settings = await self._get_security_settings(guild_id)
         return settings.get("security_log_channel_id")
 
-    def _is_whitelisted(self, user_id: int, guild_id: int) -> bool:
-        query = "SELECT id FROM security_whitelist WHERE user_id %s AND guild_id = %s"
-        result = self.db.fetch_one(query, (user_id, guild_id))
-        return result is not None
+    async def _get_whitelist(self, guild_id: int) -> set:
+        whitelist = self._whitelist_cache.get(guild_id)
+        if whitelist is None:
+            rows = await self.db.run(self.db.fetch_all, _SQL_GET_WHITELIST, (guild_id,))
+            whitelist = {row[0] for row in rows} or _EMPTY_WHITELIST
+            self._whitelist_cache[guild_id] = whitelist
+        return whitelist
+
+    async def _is_whitelisted(self, user_id: int, guild_id: int) -> bool:
+        return user_id in await self._get_whitelist(guild_id)
     
-    def _add_to_whitelist(self, user_id: int, guild_id: int, added_by: int = None) -> bool:
-        return self.db.insert("security_whitelist", {
+    async def _add_to_whitelist(self, user_id: int, guild_id: int, added_by: int = None) -> bool:
+        success = await self.db.run(self.db.insert, "security_whitelist", {
             "user_id": user_id,
             "guild_id": guild_id,
             "added_by": added_by
         }) is not None
+        if success:
+            whitelist = await self._get_whitelist(guild_id)
+            if whitelist is _EMPTY_WHITELIST:
+                whitelist = self._whitelist_cache[guild_id] = set()
+            whitelist.add(user_id)
+        return success
     
-    def _remove_from_whitelist(self, user_id: int, guild_id: int) -> bool:
-        return self.db.delete("security_whitelist", "user_id = %s AND guild_id = %s", (user_id, guild_id))
+    async def _remove_from_whitelist(self, user_id: int, guild_id: int) -> bool:
+        success = await self.db.run(self.db.delete, "security_whitelist", "user_id = %s AND guild_id = %s", (user_id, guild_id))
+        if success:
+            whitelist = await self._get_whitelist(guild_id)
+            if whitelist:
+                whitelist.discard(user_id)
+                if not whitelist:
+                    self._whitelist_cache[guild_id] = _EMPTY_WHITELIST
+        return success
     
-    def _save_backup(self, guild_id: int, backup_data: dict) -> bool:
-        backup_json = json.dumps(backup_data)
-
-        existing = self.db.fetch_one("SELECT id FROM server_backups WHERE guild_id = %s", (guild_id,))
+    def _store_backup(self, guild_id: int, backup_data: dict) -> bool:
+        return self.db.execute_query(_SQL_SAVE_BACKUP, (guild_id, _compress_backup(backup_data)))
 
-        if existing:
-            return self.db.update("server_backups", {"backup_data": backup_json}, "guild_id = %s", (guild_id,))
-        else:
-            return self.db.insert("server_backups", {"guild_id": guild_id, "backup_data": backup_json}) is not None
+    async def _save_backup(self, guild_id: int, backup_data: dict) -> bool:
+        return await self.db.run(self._store_backup, guild_id, backup_data)
     
-    def _get_backup(self, guild_id: int) -> dict:
-        query = "SELECT backup_data FROM server_backups WHERE guild_id = %s"
-        result = self.db.fetch_one(query, (guild_id))
+    def _load_backup(self, guild_id: int) -> dict:
+        result = self.db.fetch_one(_SQL_GET_BACKUP, (guild_id,))
 
-        if result and result[0]:
-            return json.loads(result[0])
-        return None
+        if not result or not result[0]:
+            return None
+        return _decompress_backup(result[0])
+
+    async def _get_backup(self, guild_id: int) -> dict:
+        return await self.db.run(self._load_backup, guild_id)
     
-    async def _send_security_log(self, guild_id: int, embed: discord.Embed, view: discord.ui.View = None):
-        channel_id = self._get_security_log_channel(guild_id)
+    async def _send_security_log(self, guild_id: int, embed: discord.Embed, view: discord.ui.View = None, settings: dict = None):
+        channel_id = settings["security_log_channel_id"] if settings else await self._get_security_log_channel(guild_id)
 
         if not channel_id:
             logger.info(f"No security log channel configured for guild {guild_id}")
             return False
         
-        channel = self.bot.get_channel(channel_id)
-
-        if not channel:
-            logger.warning(f"Security log channel {channel_id} not found for guild {guild_id}")
-            return False
+        channel = self._log_channel_cache.get(guild_id)
+        if channel is None or channel.id != channel_id:
+            channel = self.bot.get_channel(channel_id)
+
+            if not channel:
+                logger.warning(f"Security log channel {channel_id} not found for guild {guild_id}")
+                return False
+            self._log_channel_cache[guild_id] = channel
         
         try:
             if view:
@@ -217,72 +383,115 @@ class Security(commands.Cog):
             logger.error(f"Error sending security log: {e}")
             return False
     
-    @tasks.loop(seconds=5)
-    async def check_raid_loop(self):
-        now = datetime.utcnow()
+    @tasks.loop(minutes=10)
+    async def gc_transient_state(self):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=TRANSIENT_STATE_TTL)
+
+        for user_id, msg_log in list(self.user_messages.items()):
+            if not msg_log or msg_log[-1][1] < cutoff:
+                del self.user_messages[user_id]
+
+        for user_id, dm_log in list(self.dm_tracker.items()):
+            if not dm_log or dm_log[-1] < cutoff:
+                del self.dm_tracker[user_id]
 
         for guild_id, timestamps in list(self.joins.items()):
-            settings = self._get_security_settings(guild_id)
+            if not timestamps or timestamps[-1] < cutoff:
+                del self.joins[guild_id]
 
-            if not settings["anti_raid_enabled"]:
-                continue
+        for key, recent in list(self.action_logs.items()):
+            if not recent or recent[-1] < cutoff:
+                del self.action_logs[key]
 
-            raid_threshold = settings["raid_join_threshold"]
-            time_window = settings["raid_time_windoww"]
+    async def _check_raid(self, guild_id: int, timestamps: deque, settings: dict, now: datetime):
+        time_window = settings["raid_time_window"]
 
-            self.joins[guild_id] = deque([t for t in timestamps if (now - t).total_seconds() <= time_window])
+        cutoff = now - timedelta(seconds=time_window)
+        while timestamps and timestamps[0] < cutoff:
+            timestamps.popleft()
 
-            if len(self.joins[guild_id]) >= raid_threshold and not self.raid_mode.get(guild_id, False):
-                self.raid_mode[guild_id] = True
+        if len(timestamps) < settings["raid_join_threshold"]:
+            return
 
-                guild = self.bot.get_guild(guild_id)
-                if not guild:
-                    continue
+        self.raid_mode[guild_id] = True
 
-                view = DisableRaidButton(self, guild_id)
-                embed = discord.Embed(title="Security Alert", description="Potential raid detected! ", color=discord.Color.red())
-                embed.add_field(name="Alert: ", value="Raid Detected", inline=False)
-                embed.add_field(name="Details: ", value=f"{len(self.joins[guild_id])} members joined in {time_window} seconds", inline=False)
-                embed.add_field(name="Action: ", value="Kicking new joining members until disabled by administrator", inline=False)
-                await self._send_security_log(guild_id, embed, view)
+        view = DisableRaidButton(self, guild_id)
+        embed = discord.Embed(title="Security Alert", description="Potential raid detected! ", color=discord.Color.red())
+        embed.add_field(name="Alert: ", value="Raid Detected", inline=False)
+        embed.add_field(name="Details: ", value=f"{len(timestamps)} members joined in {time_window} seconds", inline=False)
+        embed.add_field(name="Action: ", value="Kicking new joining members until disabled by administrator", inline=False)
+        await self._send_security_log(guild_id, embed, view, settings=settings)
     
     @tasks.loop(seconds=5)
     async def watch_audit_log(self):
         now = datetime.now(timezone.utc)
 
         for guild in self.bot.guilds:
-            settings = self._get_security_settings(guild.id)
+            settings = await self._get_security_settings(guild.id)
 
             if not settings["anti_nuke_enabled"]:
                 continue
 
-            for action_type, discord_action in {
-                'ban': discord.AuditLogAction.ban,
-                'kick': discord.AuditLogAction.kick,
-                "channel_delete": discord.AuditLogAction.channel_delete,
-                "role_delete": discord.AuditLogAction.role_delete,
-                "emoji_delete": discord.AuditLogAction.emoji_delete
-            }.items():
-                try:
-                    async for entry in guild.audit_logs(limit=5, action=discord_action):
-                        if (now - entry.created_at).total_seconds() > 10:
-                            continue
+            last_seen = self._audit_cursor.get(guild.id)
+            newest = last_seen or 0
+            try:
+                async for entry in guild.audit_logs(limit=25, after=discord.Object(id=last_seen) if last_seen else None):
+                    newest = max(newest, entry.id)
+                    action_type = self.NUKE_ACTIONS.get(entry.action)
+                    if action_type is None:
+                        continue
+
+                    if (now - entry.created_at).total_seconds() > 10:
+                        continue
+
+                    if entry.user is None or entry.user.id in (self.bot.user.id, guild.owner_id):
+                        continue
+
+                    user_id = entry.user.id
 
-                        user_id = entry.user.id
+                    if await self._is_whitelisted(user_id, guild.id):
+                        continue
 
-                        if self._is_whitelisted(user_id, guild.id):
+                    key = (guild.id, user_id, action_type)
+                    recent = self.action_logs.get(key)
+                    if recent is None:
+                        recent = self.action_logs[key] = deque(maxlen=ACTION_LOG_SIZE)
+                    recent.append(now)
+
+                    count, seconds = self.thresholds[guild.id][action_type]
+                    cutoff = now - timedelta(seconds=seconds)
+                    while recent[0] < cutoff:
+                        recent.popleft()
+                    
+                    if len(recent) >= count:
+                        member = entry.user if isinstance(entry.user, discord.Member) else guild.get_member(user_id)
+                        if member is None:
                             continue
+                        await self.take_nuke_action(guild, member, action_type, len(recent))
+                        del self.action_logs[key]
+            except Exception as e:
+                logger.error(f"Error reading audit logs for guild {guild.id}: {e}")
 
-                        self.action_logs[guild.id][user_id].append((action_type, now))
+            if newest:
+                self._audit_cursor[guild.id] = newest
 
-                        count, seconds = self.thresholds[guild.id][action_type]
-                        recent = [t for a, t in self.action_logs[guild.id][user_id] if a == action_type and (now - t).total_seconds() <= seconds]
-                        
-                        if len(recent) >= count:
-                            await self.take_nuke_action(guild, entry.user, action_type, len(recent))
-                            self.action_logs[guild.id][user_id].clear()
-                except Exception as e:
-                    logger.error(f"Error reading audit logs for guild {guild.id}: {e}")
+        self._audit_retry_delay = AUDIT_RETRY_MIN
+
+    @watch_audit_log.before_loop
+    async def before_watch_audit_log(self):
+        await self.bot.wait_until_ready()
+
+    @watch_audit_log.error
+    async def watch_audit_log_error(self, error: Exception):
+        delay = self._audit_retry_delay
+        self._audit_retry_delay = min(delay * 2, AUDIT_RETRY_MAX)
+        logger.error(f"Audit log watcher stopped, restarting in {delay}s: {error}")
+        self._audit_restart = asyncio.get_running_loop().call_later(delay, self._restart_audit_watch)
+
+    def _restart_audit_watch(self):
+        self._audit_restart = None
+        if not self.watch_audit_log.is_running():
+            self.watch_audit_log.start()
     
     async def take_nuke_action(self, guild: discord.Guild, user: discord.Member, action_type: str, count: int):
         try:
@@ -298,19 +507,23 @@ class Security(commands.Cog):
             view = GiveRolesBackView(original_roles, user)
             await self._send_security_log(guild.id, embed, view)
         except discord.Forbidden:
-            await logger.warning(f"Tried to strip roles from {user.mention} but lacked permissions")
+            logger.warning(f"Tried to strip roles from {user.mention} but lacked permissions")
 
     @commands.Cog.listener()
     async def on_message(self, message : discord.Message):
         if message.author.bot:
             return
         
+        now = datetime.now(timezone.utc)
+
         if isinstance(message.channel, discord.DMChannel):
-            now = datetime.now(timezone.utc)
-            self.dm_tracker[message.author.id].append(now)
-            self.dm_tracker[message.author.id] = [t for t in self.dm_tracker[message.author.id] if (now - t).seconds < 15]
+            dm_log = self.dm_tracker[message.author.id]
+            dm_log.append(now)
+            cutoff = now - timedelta(seconds=15)
+            while dm_log[0] <= cutoff:
+                dm_log.popleft()
 
-            if len(self.dm_tracker[message.author.id]) > 5:
+            if len(dm_log) > 5:
                 try:
                     await message.author.send("You are sending messages too quickly. This may be considered spam!")
                 except Exception as e:
@@ -320,84 +533,80 @@ class Security(commands.Cog):
         if not message.guild:
             return
         
-        settings = self._get_security_settings(message.guild.id)
+        settings = await self._get_security_settings(message.guild.id)
 
         if settings["anti_spam_enabled"]:
-            await self._check_spam(message, settings)
+            await self._check_spam(message, settings, now)
 
         if settings["anti_suspicious_links_enabled"]:
-            await self._check_suspicious_links(message, settings)
+            await self._check_suspicious_links(message, settings, now)
 
         if settings["anti_selfbot_enabled"]:
-            await self._check_selfbot(message, settings)
+            await self._check_selfbot(message, settings, now)
     
-    async def _check_spam(self, message: discord.Message, settings: dict):
+    async def _check_spam(self, message: discord.Message, settings: dict, now: datetime):
         author = message.author
-        now = datetime.utcnow()
         msg_log = self.user_messages[author.id]
         msg_log.append((message, now))
 
-        interval = settings["spam_time_window"]
-        while msg_log and (now - msg_log[0][1]).total_seconds() > interval:
+        cutoff = now - timedelta(seconds=settings["spam_time_window"])
+        while msg_log[0][1] < cutoff:
             msg_log.popleft()
 
         if len(msg_log) >= settings["spam_message_threshold"]:
-            await self.take_spam_action(author, msg_log, message)
+            await self.take_spam_action(author, msg_log, message, settings)
             return
         
         content = message.content
         same_count = sum(1 for msg, _ in msg_log if msg.content == content)
         if same_count >= settings["spam_duplicate_threshold"]:
-            await self.take_spam_action(author, msg_log, message)
+            await self.take_spam_action(author, msg_log, message, settings)
             return
         
         if len(message.mentions) >= settings["spam_mention_threshold"]:
-            await self.take_spam_action(author, msg_log, message)
+            await self.take_spam_action(author, msg_log, message, settings)
             return
         
-        link_count = len(re.findall(r'https?://', message.content))
+        link_count = len(self.LINK_RE.findall(message.content))
         if link_count >= settings['spam_link_threshold']:
-            await self.take_spam_action(author, msg_log, message)
+            await self.take_spam_action(author, msg_log, message, settings)
             return
     
-    async def _check_suspicious_links(self, message: discord.Message, settings: dict):
-        suspicous_links = ["discord.gift", "free-nitro", "steam-giveaway", "airdrop", "login.discord", "discord-app"]
-
-        if any(link in message.content.lower() for link in suspicous_links):
+    async def _check_suspicious_links(self, message: discord.Message, settings: dict, now: datetime):
+        if self.SUSPICIOUS_RE.search(message.content):
             try:
                 await message.delete()
-                await message.author.timeout(datetime.now(timezone).utc + timedelta(minutes=30), reason="Suspicous links detected")
+                await message.author.timeout(now + timedelta(minutes=30), reason="Suspicous links detected")
 
                 embed = discord.Embed(title="Suspicous Link Detected", description="Potental scam link removed", color=discord.Color.orange())
                 embed.add_field(name="User: ", value=f"{message.author.mention}", inline=False)
                 embed.add_field(name="Action: ", value="Messge deleted, user timed out for 30 minutes", inline=False)
                 
-                await self._send_security_log(message.guild.id, embed)
+                await self._send_security_log(message.guild.id, embed, settings=settings)
             except Exception as e:
                 logger.error(f"Error handling suspcious link: {e}")
     
-    async def _check_selfbot(self, message: discord.Message, settings: dict):
-        if not message.content:
+    async def _check_selfbot(self, message: discord.Message, settings: dict, now: datetime):
+        content = message.content
+        if not content:
             return
         
-        rapid_fire_patterns = ["@everyone", "http", ":", '.com', "discord.gg"]
-        caps_ratio = sum(1 for c in message.content if c.isupper()) / max(len(message.content), 1)
-
-        if(any(p in message.content.lower() for p in rapid_fire_patterns) and caps_ratio > 0.5) or len(message.embeds) > 0:
+        # The capitals count is a full pass over the text, so only pay for it once a pattern has matched
+        if message.embeds or (self.SELFBOT_RE.search(content) and sum(map(str.isupper, content)) > len(content) / 2):
             try:
                 await message.delete()
-                await message.author.timeout(datetime.now(timezone.utc) + timedelta(minutes=30), reason="Possible self-bot activitiy")
+                await message.author.timeout(now + timedelta(minutes=30), reason="Possible self-bot activitiy")
                 embed = discord.Embed(title="Self-Bot Detection", description="Automated bot-like behavior detected", color=discord.Color.red())
                 embed.add_field(name="User: ", value=f"{message.author.mention}", inline=False)
                 embed.add_field(name="Action: ", value="Message deleted, user timed out for 30 minutes", inline=False)
 
-                await self._send_security_log(message.guild.id, embed)
+                await self._send_security_log(message.guild.id, embed, settings=settings)
             except Exception as e:
                 logger.error(f"Error dectecting self-bot: {e}")
     
-    async def take_spam_action(self, member : discord.Member, msg_log, trigger_message):
+    async def take_spam_action(self, member : discord.Member, msg_log, trigger_message, settings: dict = None):
         try:
-            until = datetime.utcnow() + timedelta(minutes=10)
+            until = datetime.now(timezone.utc) + timedelta(minutes=10)
             await member.timeout(until, reason="Spam detected by Anti=Spam")
 
             for msg, _ in list(msg_log):
@@ -413,20 +622,24 @@ class Security(commands.Cog):
             embed.add_field(name="Action: ", value="Timed out for 10 minutes, messages deleted", inline=False)
             embed.set_footer(text=f"User: {member.name}")
 
-            await self._send_security_log(member.guild.id, embed, view)
+            await self._send_security_log(member.guild.id, embed, view, settings=settings)
         except Exception as e:
             logger.error(f"Anti-Spam: Error punishing {member.name}: {e}")
 
     @commands.Cog.listener()
     async def on_member_join(self, member : discord.Member):
         guild_id = member.guild.id
-        settings = self._get_security_settings(guild_id)
-        now = datetime.utcnow()
+        settings = await self._get_security_settings(guild_id)
+        now = datetime.now(timezone.utc)
 
-        if guild_id not in self.joins:
-            self.joins[guild_id] = deque()
+        timestamps = self.joins.get(guild_id)
+        if timestamps is None:
+            timestamps = self.joins[guild_id] = deque(maxlen=JOIN_LOG_SIZE)
         
-        self.joins[guild_id].append(now)
+        timestamps.append(now)
+
+        if settings["anti_raid_enabled"] and not self.raid_mode.get(guild_id, False):
+            await self._check_raid(guild_id, timestamps, settings, now)
 
         if settings["anti_raid_enabled"] and self.raid_mode.get(guild_id, False) and not member.bot:
             try:
@@ -435,23 +648,23 @@ class Security(commands.Cog):
                 embed = discord.Embed(title="Raid Protection", description="Member kicked due to active raid mode", color=discord.Color.orange())
                 embed.add_field(name="User: ", value=f"{member.mention} (`{member.id}`)", inline=False)
 
-                await self._send_security_log(guild_id, embed)
+                await self._send_security_log(guild_id, embed, settings=settings)
             except discord.Forbidden:
                 logger.warning(f"Missing permissions to kick {member}")
             except Exception as e:
                 logger.error(f"Error kicking {member}: {e}")
         
         if settings["anti_alt_enabled"] and not member.bot:
-            account_age = (datetime.now(timezone.utc) - member.created_at).days
+            account_age = (now - member.created_at).days
             if account_age < settings["min_account_age_days"]:
                 try:
-                    await member.timeout(until=datetime.now(timezone.utc) + timedelta(minutes=10), reason=f"Alt account detected (account age: {account_age} days)")
+                    await member.timeout(until=now + timedelta(minutes=10), reason=f"Alt account detected (account age: {account_age} days)")
                     embed = discord.Embed(title="Alt Account Detection", description="Suspiciously new account detected", color=discord.Color.yellow())
                     embed.add_field(name="User: ", value=f"{member.mention} (`{member.id}`)", inline=False)
                     embed.add_field(name="Account Age: ", value=f"{account_age} days", inline=False)
                     embed.add_field(name="Action: ", value="Timed out for 10 minutes for review", inline=False)
 
-                    await self._send_security_log(guild_id, embed)
+                    await self._send_security_log(guild_id, embed, settings=settings)
                 except Exception as e:
                     logger.error(f"Failed to timeout alt: {e}")
         
@@ -461,7 +674,7 @@ class Security(commands.Cog):
                 if entry.target.id == member.id:
                     inviter = entry.user
 
-                    if self._is_whitelisted(inviter.id, guild.id):
+                    if await self._is_whitelisted(inviter.id, guild.id):
                         return
                     
                     original_roles = [role for role in inviter.roles if role.name != "@everyone"]
@@ -477,20 +690,26 @@ class Security(commands.Cog):
                         embed.add_field(name="Action: ", value="Inviter roles stripped, bot kicked", inline=False)
                         embed.set_footer(text=f"Inviter: {inviter.name}")
                         
-                        await self._send_security_log(guild_id, embed, view)
+                        await self._send_security_log(guild_id, embed, view, settings=settings)
                     except discord.Forbidden:
                         logger.warning(f"Missing permissions to handle unauthorized bot")
                     break
     
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        cached = self._log_channel_cache.get(channel.guild.id)
+        if cached is not None and cached.id == channel.id:
+            del self._log_channel_cache[channel.guild.id]
+    
     @commands.Cog.listener()
     async def on_webhooks_update(self, channel: discord.TextChannel):
         guild = channel.guild
 
         try:
             async for entry in guild.audit_logs(limit=1, action=discord.AuditLogAction.webhook_create):
-                if(datetime.now(timezone.utc) - entry.created_at).seconds < 10:
+                if (datetime.now(timezone.utc) - entry.created_at).total_seconds() < 10:
                     if not entry.user.guild_permissions.administrator:
-                        if not self._is_whitelisted(entry.user.id, guild.id):
+                        if not await self._is_whitelisted(entry.user.id, guild.id):
                             await entry.user.kick(reason="Unauthorized webhook creation")
 
                             embed = discord.Embed(title="Unauthorized WWebhook", description="Webhook created without authorization", color=discord.Color.red())
@@ -504,36 +723,60 @@ class Security(commands.Cog):
     
     async def trigger_panic_mode(self, guild: discord.Guild, reason: str):
         try:
-            self.original_permissions[guild.id] = {}
+            default_role = guild.default_role
+            original = {}
+            updates = []
             for channel in guild.text_channels:
-                overwrite = channel.overwrites_for(guild.default_role)
-                self.original_permissions[guild.id][channel.id] = overwrite.send_messages
+                overwrite = channel.overwrites_for(default_role)
+                original[channel.id] = overwrite.send_messages
                 overwrite.send_messages = False
-                await channel.set_permissions(guild.default_role, overwrite=overwrite)
+                updates.append(channel.set_permissions(default_role, overwrite=overwrite))
+
+            # Persist the originals first so a restart mid-lockdown can still be undone
+            self.original_permissions[guild.id] = original
+            await self.db.run(self.db.execute_query, _SQL_SAVE_PANIC, (guild.id, json.dumps(original)))
+
+            results = await asyncio.gather(*updates, return_exceptions=True)
+            failed = sum(isinstance(result, Exception) for result in results)
+            if failed:
+                logger.warning(f"Panic mode failed to lock {failed} channels in guild {guild.id}")
             
             embed = discord.Embed(title="Panic Mode Activated", description=f"Server locked down: {reason}", color=discord.Color.dark_red())
             await self._send_security_log(guild.id, embed)
         except Exception as e:
             logger.error(f"Error triggering panic mode: {e}")
 
-    async def unpanic_mode(self, guild: discord.Guild):
+    async def unpanic_mode(self, guild: discord.Guild) -> bool:
         try:
-            if guild.id not in self.original_permissions:
-                return
-
+            original = self.original_permissions.get(guild.id)
+            if original is None:
+                row = await self.db.run(self.db.fetch_one, _SQL_GET_PANIC, (guild.id,))
+                if not row:
+                    return False
+                original = {int(channel_id): send_messages for channel_id, send_messages in json.loads(row[0]).items()}
+
+            default_role = guild.default_role
+            updates = []
             for channel in guild.text_channels:
-                if channel.id in self.original_permissions[guild.id]:
-                    original_perm = self.original_permissions[guild.id][channel.id]
-                    overwrite = channel.overwrites_for(guild.default_role)
-                    overwrite.send_messages = original_perm
-                    await channel.set_permissions(guild.default_role, overwrite=overwrite)
+                if channel.id in original:
+                    overwrite = channel.overwrites_for(default_role)
+                    overwrite.send_messages = original[channel.id]
+                    updates.append(channel.set_permissions(default_role, overwrite=overwrite))
 
-            del self.original_permissions[guild.id]
+            results = await asyncio.gather(*updates, return_exceptions=True)
+            failed = sum(isinstance(result, Exception) for result in results)
+            if failed:
+                logger.warning(f"Panic mode failed to unlock {failed} channels in guild {guild.id}")
+
+            self.original_permissions.pop(guild.id, None)
+            await self.db.run(self.db.delete, "security_panic_state", "guild_id = %s", (guild.id,))
 
             embed = discord.Embed(title="Panic Mode Deactivated", description="Server unlocked", color=discord.Color.green())
             await self._send_security_log(guild.id, embed)
+            return True
         except Exception as e:
             logger.error(f"Error reversing panic mode: {e}")
+            return False
     
     security = SlashCommandGroup("security", "Security system commands")
 
@@ -542,10 +785,10 @@ class Security(commands.Cog):
     async def whitelist(self, ctx : discord.ApplicationContext, member: Option(discord.Member, description="Member to whitelist", required=True)): # type: ignore
         await ctx.defer()
 
-        if self._is_whitelisted(member.id, ctx.guild.id):
+        if await self._is_whitelisted(member.id, ctx.guild.id):
             return await ctx.respond(f"{member.mention} is already whitelisted", ephemeral=True)
 
-        success = self._add_to_whitelist(member.id, ctx.guild.id, ctx.author.id)
+        success = await self._add_to_whitelist(member.id, ctx.guild.id, ctx.author.id)
 
         if success:
             embed = discord.Embed(title="User Whitelisted", description=f"{member.mention} has been added to the security whitelist", color=discord.Color.green())
@@ -559,10 +802,10 @@ class Security(commands.Cog):
     async def unwhitelist(self, ctx: discord.ApplicationContext, member: Option(discord.Member, description="Member to remove from whitelist", required=True)): # type: ignore
         await ctx.defer()
 
-        if not self._is_whitelisted(member.id, ctx.guild.id):
+        if not await self._is_whitelisted(member.id, ctx.guild.id):
             return await ctx.respond(f"{member.mention} is not whitelisted", ephemeral=True)
 
-        success = self._remove_from_whitelist(member.id, ctx.guild.id)
+        success = await self._remove_from_whitelist(member.id, ctx.guild.id)
 
         if success:
             await ctx.respond(f"{member.mention} has been removed from the security whitelist.")
@@ -575,7 +818,7 @@ class Security(commands.Cog):
         await ctx.defer()
 
         query = "SELECT user_id, added_by, created_at FROM security_whitelist WHERE guild_id = %s"
-        results = self.db.fetch_all_dict(query, (ctx.guild.id,))
+        results = await self.db.run(self.db.fetch_all_dict, query, (ctx.guild.id,))
 
         if not results:
             await ctx.respond("No whitelisted users found.")
@@ -607,69 +850,64 @@ class Security(commands.Cog):
     @commands.has_guild_permissions(administrator=True)
     async def unpanic_command(self, ctx: discord.ApplicationContext):
         await ctx.defer()
-        await self.unpanic_mode(ctx.guild)
-        await ctx.respond("**Panic mode deactivated!** Channels have been unlocked.")
+        if await self.unpanic_mode(ctx.guild):
+            await ctx.respond("**Panic mode deactivated!** Channels have been unlocked.")
+        else:
+            await ctx.respond("No saved panic mode state was found for this server, so no channels were changed.")
     
     @security.command(name="backupserver", description="Backup server configuration")
     @commands.has_guild_permissions(administrator=True)
     async def backup_server(self, ctx: discord.ApplicationContext):
         await ctx.defer()
         guild = ctx.guild
+        now = datetime.now(timezone.utc)
 
-        backup_data = {
-            "guild_id": guild.id,
-            "guild_name": guild.name,
-            "timestamp": datetime.utcnow().isoformat(),
-            "channels": [],
-            "roles": [],
-            "categories": []
-        }
-
-        for category in guild.categories:
-            backup_data["categories"].append({
-                "name": category.name,
-                "position": category.position
-            })
+        CategoryChannel = discord.CategoryChannel
+        templates = {}
 
-        for channel in guild.channels:
-            if isinstance(channel, discord.CategoryChannel):
-                continue
-            overwrite_data = {}
-            for target, overwrite in channel.overwrites.items():
-                if isinstance(target, discord.Role):
-                    overwrite_data[str(target.id)] = {
-                        "send_messages": overwrite.send_messages,
-                        "view_channel": overwrite.view_channel
-                    }
-            backup_data["channels"].append({
+        categories = [{"name": category.name, "position": category.position} for category in guild.categories]
+        # Channels synced to the same roles share one template instead of repeating it
+        channels = [
+            {
                 "name": channel.name,
                 "type": str(channel.type),
                 "position": channel.position,
                 "category": channel.category.name if channel.category else None,
-                "overwrites": overwrite_data
-            })
-
-        
-        for role in guild.roles:
-            if role.is_default():
-                continue
-            backup_data["roles"].append({
+                "overwrites_template": templates.setdefault(_overwrite_key(channel), len(templates))
+            }
+            for channel in guild.channels if not isinstance(channel, CategoryChannel)
+        ]
+        roles = [
+            {
                 "name": role.name,
                 "permissions": role.permissions.value,
                 "colour": role.colour.value,
                 "hoist": role.hoist,
                 "mentionable": role.mentionable,
                 "position": role.position
-            })
+            }
+            for role in guild.roles if not role.is_default()
+        ]
+        overwrite_templates = [[list(entry) for entry in template_key] for template_key in templates]
 
-        success = self._save_backup(guild.id, backup_data)
+        backup_data = {
+            "guild_id": guild.id,
+            "guild_name": guild.name,
+            "timestamp": now.isoformat(),
+            "channels": channels,
+            "roles": roles,
+            "categories": categories,
+            "overwrite_templates": overwrite_templates
+        }
+
+        success = await self._save_backup(guild.id, backup_data)
 
         if success:
             embed = discord.Embed(title="Server Backed Up", description="Server configuration has been saved", color=discord.Color.green())
             embed.add_field(name="Roles: ", value=str(len(backup_data["roles"])), inline=True)
             embed.add_field(name="Channels: ", value=str(len(backup_data["channels"])), inline=True)
             embed.add_field(name="Cateogies: ", value=str(len(backup_data["categories"])), inline=True)
-            embed.set_footer(text=f"Backup created at {datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")} UTC")
+            embed.set_footer(text=f"Backup created at {now.strftime('%Y-%m-%d %H:%M:%S')} UTC")
             await ctx.respond(embed=embed)
         else:
             await ctx.respond("Failed to backup server.", ephemeral=True)
@@ -680,50 +918,82 @@ class Security(commands.Cog):
         await ctx.defer()
         guild = ctx.guild
 
-        backup_data = self._get_backup(guild.id)
+        backup_data = await self._get_backup(guild.id)
         if not backup_data:
             await ctx.respond("No backup found for this server. Use `/security backupserver` first.")
             return
         
         await ctx.respond("**Restoring server...** This may take several minutes.")
 
-        category_mapping = {}
-        restored_roles = 0
-        restored_categories = 0
-        restored_channels = 0
+        roles = sorted(backup_data["roles"], key=lambda r: r["position"], reverse=True)
+        results = await _run_batched([functools.partial(guild.create_role, name=role_data["name"], permissions=discord.Permissions(role_data["permissions"]), colour=discord.Colour(role_data["colour"]), hoist=role_data["hoist"], mentionable=role_data["mentionable"]) for role_data in roles])
 
-        for role_data in sorted(backup_data["roles"], key=lambda r: r["position"], reverse=True):
+        created_roles = []
+        for role_data, result in zip(roles, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error restoring role {role_data['name']}: {result}")
+            else:
+                created_roles.append(result)
+        restored_roles = len(created_roles)
+
+        # Roles created side by side land in arbitrary order at the bottom, so restack them in one call
+        if restored_roles > 1:
             try:
-                await guild.create_role(name=role_data["name"], permissions=discord.Permissions(role_data["permissions"]), colour=discord.Colour(role_data["colour"]), hoist=role_data["hoist"], mentionable=role_data["mentionable"])
-                restored_roles += 1
-            except Exception as e:
-                logger.error(f"Error restoring role {role_data['name']}: {e}")
+                await guild.edit_role_positions(positions={role: restored_roles - idx for idx, role in enumerate(created_roles)})
+            except discord.HTTPException as e:
+                logger.warning(f"Error reordering restored roles in guild {guild.id}: {e}")
         
-        for cat_data in sorted(backup_data["categories"], key=lambda c: c["position"]):
-            try:
-                new_category = await guild.create_category(name=cat_data["name"], position=cat_data["position"])
-                category_mapping[cat_data["name"]] = new_category
-                restored_categories += 1
-            except Exception as e:
-                logger.error(f"Error restoring category {cat_data['name']}: {e}")
+        categories = sorted(backup_data["categories"], key=lambda c: c["position"])
+        results = await _run_batched([functools.partial(guild.create_category, name=cat_data["name"], position=cat_data["position"]) for cat_data in categories])
+
+        category_mapping = {}
+        channel_positions = []
+        for cat_data, result in zip(categories, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error restoring category {cat_data['name']}: {result}")
+            else:
+                category_mapping[cat_data["name"]] = result
+                channel_positions.append({"id": result.id, "position": cat_data["position"]})
+        restored_categories = len(category_mapping)
         
-        for ch in backup_data["channels"]:
+        role_map = {role.id: role for role in guild.roles}
+        templates = [_resolve_overwrites(role_map, template) for template in backup_data.get("overwrite_templates", ())]
+
+        channels = []
+        calls = []
+        for ch in sorted(backup_data["channels"], key=lambda c: c["position"]):
+            if ch["type"] == "text":
+                create_channel = guild.create_text_channel
+            elif ch["type"] == "voice":
+                create_channel = guild.create_voice_channel
+            else:
+                continue
+
+            if "overwrites_template" in ch:
+                overwrites = templates[ch["overwrites_template"]]
+            else:
+                overwrites = _resolve_overwrites(role_map, ch["overwrites"])
+
+            channels.append(ch)
+            calls.append(functools.partial(create_channel, name=ch["name"], overwrites=overwrites, position=ch["position"], category=category_mapping.get(ch["category"])))
+
+        results = await _run_batched(calls)
+
+        restored_channels = 0
+        for ch, result in zip(channels, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error restoring channel {ch['name']}: {result}")
+            else:
+                restored_channels += 1
+                channel_positions.append({"id": result.id, "position": ch["position"]})
+
+        # Categories and channels created side by side also settle in arbitrary order, so restack them in one call as well.
+        # py-cord 2.4 has no public bulk channel position edit, so this goes through the same endpoint Guild uses internally
+        if len(channel_positions) > 1:
             try:
-                overwrites = {}
-                for role_id, perms in ch["overwrites"].items():
-                    role = guild.get_role(int(role_id))
-                    if role:
-                        overwrites[role] = discord.PermissionOverwrite(send_messages=perms["send_messages"], view_channel=perms["view_channel"])
-                category = category_mapping.get(ch["category"])
-
-                if ch["type"] == "text":
-                    await guild.create_text_channel(name=ch["name"], overwrites=overwrites, position=ch["position"], category=category)
-                    restored_channels += 1
-                elif ch["type"] == "voice":
-                    await guild.create_voice_channel(name=ch["name"], overwrites=overwrites, position=ch['position'], category=category)
-                    restored_channels += 1
-            except Exception as e:
-                logger.error(f"Error restoring channel {ch['name']}: {e}")
+                await guild._state.http.bulk_channel_update(guild.id, channel_positions, reason="Server restore")
+            except discord.HTTPException as e:
+                logger.warning(f"Error reordering restored channels in guild {guild.id}: {e}")
 
         embed = discord.Embed(title="Server Restored", description="Server configuration has been restored from backup", color=discord.Color.green())
         embed.add_field(name="Roles Restored: ", value=str(restored_roles), inline=True)
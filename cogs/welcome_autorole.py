@@ -1,20 +1,72 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.commands import SlashCommandGroup, Option
 from datetime import datetime, timedelta
+from collections import defaultdict
 import asyncio
 import re
 import logging
-from utils.mysql_helper import MySQLHelper
-from config import MYSQL_CONFIG
+from utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+SETTINGS_CACHE_SIZE = 10_000
+SETTINGS_CACHE_TTL = 60
+TRACKING_FLUSH_INTERVAL = 2
+TRACKING_FLUSH_THRESHOLD = 500
+TRACKING_BUFFER_LIMIT = 10_000
+
+_SQL_GET_WELCOME = "SELECT * FROM welcome_settings WHERE guild_id = %s"
+_SQL_SEED_WELCOME = "INSERT IGNORE INTO welcome_settings (guild_id) VALUES (%s)"
+_SQL_GET_GOODBYE = "SELECT * FROM goodbye_settings WHERE guild_id = %s"
+_SQL_SEED_GOODBYE = "INSERT IGNORE INTO goodbye_settings (guild_id) VALUES (%s)"
+_SQL_INSERT_TRACKING = """
+    INSERT INTO member_tracking (guild_id, user_id, action_type)
+    VALUES (%s, %s, %s)
+"""
+_SQL_INSERT_STATS = """
+    INSERT INTO welcome_stats (guild_id, user_id, welcome_sent, dm_sent, roles_assigned)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
 class WelcomeAutoRole(commands.Cog):
+    PLACEHOLDER_RE = re.compile(r"\{(?:user|mention|server|member_count|username|discriminator|id|guild)\}")
+    HEX_COLOR_RE = re.compile(r"#?([0-9A-Fa-f]{6})")
+
     def __init__(self, bot):
         self.bot = bot
-        self.db = MySQLHelper(**MYSQL_CONFIG)
+        self.db = bot.db
+        self._welcome_cache = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_CACHE_TTL)
+        self._goodbye_cache = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_CACHE_TTL)
+        self._autorole_cache = TTLCache(maxsize=SETTINGS_CACHE_SIZE * 2, ttl=SETTINGS_CACHE_TTL)
+        self._pending_tracking = []
+        self._pending_stats = []
+        self._flushing_tracking = []
+        self._flushing_stats = []
+        self._tracking_flush_future = None
+        self._stats_flush_future = None
+        self._flush_lock = asyncio.Lock()
+        self._delayed_role_tasks = set()
+        self._seeded_welcome = set()
+        self._seeded_goodbye = set()
         self._ensure_tables()
+        self.flush_tracking_loop.start()
+
+    def cog_unload(self):
+        self.flush_tracking_loop.cancel()
+        for task in self._delayed_role_tasks:
+            task.cancel()
+        # These tables have no natural key, so in-flight rows are awaited and only resent if their write failed
+        if self._flushing_tracking and not self.db.succeeded(self._tracking_flush_future):
+            self._pending_tracking[:0] = self._flushing_tracking
+        if self._flushing_stats and not self.db.succeeded(self._stats_flush_future):
+            self._pending_stats[:0] = self._flushing_stats
+        self._flushing_tracking = []
+        self._flushing_stats = []
+        if self._pending_tracking:
+            self.db.execute_many(_SQL_INSERT_TRACKING, self._pending_tracking)
+        if self._pending_stats:
+            self.db.execute_many(_SQL_INSERT_STATS, self._pending_stats)
 
     def _ensure_tables(self):
         create_welcome_settings = """
@@ -39,7 +91,6 @@ class WelcomeAutoRole(commands.Cog):
                 INDEX idx_guild_id (guild_id)
             )
         """
-        self.db.create_table(create_welcome_settings)
         
         create_goodbye_settings = """
             CREATE TABLE IF NOT EXISTS goodbye_settings (
@@ -57,7 +108,6 @@ class WelcomeAutoRole(commands.Cog):
                 INDEX idx_guild_id (guild_id)
             )
         """
-        self.db.create_table(create_goodbye_settings)
         
         create_auto_roles = """
             CREATE TABLE IF NOT EXISTS auto_roles (
@@ -71,7 +121,6 @@ class WelcomeAutoRole(commands.Cog):
                 INDEX idx_guild_id (guild_id)
             )
         """
-        self.db.create_table(create_auto_roles)
         
         create_welcome_stats = """
             CREATE TABLE IF NOT EXISTS welcome_stats (
@@ -82,12 +131,11 @@ class WelcomeAutoRole(commands.Cog):
                 welcome_sent BOOLEAN DEFAULT FALSE,
                 dm_sent BOOLEAN DEFAULT FALSE,
                 roles_assigned INT DEFAULT 0,
-                INDEX idx_guild_id (guild_id),
                 INDEX idx_user_id (user_id),
-                INDEX idx_join_date (join_date)
+                INDEX idx_join_date (join_date),
+                INDEX idx_guild_join (guild_id, join_date, welcome_sent, dm_sent, roles_assigned)
             )
         """
-        self.db.create_table(create_welcome_stats)
         
         create_member_tracking = """
             CREATE TABLE IF NOT EXISTS member_tracking (
@@ -96,21 +144,42 @@ class WelcomeAutoRole(commands.Cog):
                 user_id BIGINT NOT NULL,
                 action_type ENUM('JOIN', 'LEAVE') NOT NULL,
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                INDEX idx_guild_id (guild_id),
-                INDEX idx_timestamp (timestamp)
+                INDEX idx_timestamp (timestamp),
+                INDEX idx_guild_ts_action (guild_id, timestamp, action_type)
             )
         """
-        self.db.create_table(create_member_tracking)
+
+        self.db.execute_many_queries([create_welcome_settings, create_goodbye_settings, create_auto_roles, create_welcome_stats, create_member_tracking])
+
+        self._migrate_indexes()
         
         logger.info("Welcome & Auto-Role tables ensured")
 
-    def _get_welcome_settings(self, guild_id: int) -> dict:
-        query = "SELECT * FROM welcome_settings WHERE guild_id = %s"
-        result = self.db.fetch_one_dict(query, (guild_id))
+    def _migrate_indexes(self):
+        migrations = (
+            ("member_tracking", "idx_guild_ts_action", "CREATE INDEX idx_guild_ts_action ON member_tracking (guild_id, timestamp, action_type)", ("idx_guild_id",)),
+            ("welcome_stats", "idx_guild_join", "CREATE INDEX idx_guild_join ON welcome_stats (guild_id, join_date, welcome_sent, dm_sent, roles_assigned)", ("idx_guild_id",))
+        )
+
+        for table, index_name, create_index, redundant in migrations:
+            if not self.db.index_exists(table, index_name):
+                self.db.execute_query(create_index)
+            for old_index in redundant:
+                if self.db.index_exists(table, old_index):
+                    self.db.execute_query(f"DROP INDEX {old_index} ON {table}")
+
+    async def _get_welcome_settings(self, guild_id: int) -> dict:
+        cached = self._welcome_cache.get(guild_id)
+        if cached is not None:
+            return cached
+
+        result = await self.db.run(self.db.fetch_one_dict, _SQL_GET_WELCOME, (guild_id,))
 
         if not result:
-            self.db.insert("welcome_settings", {"guild_id": guild_id})
-            return {
+            if guild_id not in self._seeded_welcome:
+                await self.db.run(self.db.execute_query, _SQL_SEED_WELCOME, (guild_id,))
+                self._seeded_welcome.add(guild_id)
+            result = {
                 "enabled": False,
                 "channel_id": None,
                 "message_type": "embed",
@@ -126,15 +195,22 @@ class WelcomeAutoRole(commands.Cog):
                 "test_mode": False
             }
         
+        result["_color"] = self._parse_color(result["embed_color"])
+        self._welcome_cache.set(guild_id, result)
         return result
     
-    def _get_goodbye_settings(self, guild_id: int) -> dict:
-        query = "SELECT * FROM goodbye_settings WHERE guild_id = %s"
-        result = self.db.fetch_one_dict(query, (guild_id))
+    async def _get_goodbye_settings(self, guild_id: int) -> dict:
+        cached = self._goodbye_cache.get(guild_id)
+        if cached is not None:
+            return cached
+
+        result = await self.db.run(self.db.fetch_one_dict, _SQL_GET_GOODBYE, (guild_id,))
 
         if not result:
-            self.db.insert("goodbye_settings", {"guild_id": guild_id})
-            return {
+            if guild_id not in self._seeded_goodbye:
+                await self.db.run(self.db.execute_query, _SQL_SEED_GOODBYE, (guild_id,))
+                self._seeded_goodbye.add(guild_id)
+            result = {
                 "enabled": False,
                 "channel_id": None,
                 "message_type": "embed",
@@ -144,17 +220,79 @@ class WelcomeAutoRole(commands.Cog):
                 "embed_color": "#ED4245"
             }
         
+        result["_color"] = self._parse_color(result["embed_color"])
+        self._goodbye_cache.set(guild_id, result)
         return result
     
-    def _get_auto_roles(self, guild_id: int, for_bots: bool = False) -> list:
-        query = "SELECT role_id, delay_seconds FROM auto_roles WHERE guild_id = %s AND bot_role = %s"
-        return self.db.fetch_all_dict(query, (guild_id, for_bots))
+    async def _get_auto_roles(self, guild_id: int, for_bots: bool = False) -> list:
+        cached = self._autorole_cache.get((guild_id, for_bots))
+        if cached is not None:
+            return cached
 
-    def _format_message(self, text: str, member: discord.Member, guild: discord.Guild) -> str:
-        if not text:
-            return None
-        
-        replacements = {
+        query = "SELECT role_id, delay_seconds FROM auto_roles WHERE guild_id = %s AND bot_role = %s"
+        auto_roles = await self.db.run(self.db.fetch_all_dict, query, (guild_id, for_bots))
+        self._autorole_cache.set((guild_id, for_bots), auto_roles)
+        return auto_roles
+
+    def invalidate_guild(self, guild_id: int) -> None:
+        self._welcome_cache.pop(guild_id)
+        self._goodbye_cache.pop(guild_id)
+        self._autorole_cache.pop((guild_id, False))
+        self._autorole_cache.pop((guild_id, True))
+
+    async def _queue_tracking(self, guild_id: int, user_id: int, action_type: str) -> None:
+        self._pending_tracking.append((guild_id, user_id, action_type))
+        if len(self._pending_tracking) >= TRACKING_FLUSH_THRESHOLD and not self._flush_lock.locked():
+            await self._flush_tracking()
+
+    async def _queue_stats(self, guild_id: int, user_id: int, welcome_sent: bool, dm_sent: bool, roles_assigned: int) -> None:
+        self._pending_stats.append((guild_id, user_id, welcome_sent, dm_sent, roles_assigned))
+        if len(self._pending_stats) >= TRACKING_FLUSH_THRESHOLD and not self._flush_lock.locked():
+            await self._flush_tracking()
+
+    def _requeue(self, pending: list, failed: list, label: str) -> None:
+        pending[:0] = failed
+        overflow = len(pending) - TRACKING_BUFFER_LIMIT
+        if overflow > 0:
+            del pending[:overflow]
+            logger.warning(f"Dropped {overflow} oldest {label} rows, buffer is full while the database is unavailable")
+
+    async def _flush_tracking(self) -> None:
+        # Callers that need the rows in the database wait for an in-flight flush instead of skipping it
+        async with self._flush_lock:
+            if not (self._pending_tracking or self._pending_stats):
+                return
+
+            self._flushing_tracking, self._pending_tracking = self._pending_tracking, []
+            self._flushing_stats, self._pending_stats = self._pending_stats, []
+            # Submit both batches before awaiting so an unload never sees a swapped-out batch without a future
+            if self._flushing_tracking:
+                self._tracking_flush_future = self.db.submit(self.db.execute_many, _SQL_INSERT_TRACKING, self._flushing_tracking)
+            if self._flushing_stats:
+                self._stats_flush_future = self.db.submit(self.db.execute_many, _SQL_INSERT_STATS, self._flushing_stats)
+            try:
+                if self._tracking_flush_future:
+                    success = await asyncio.wrap_future(self._tracking_flush_future)
+                    if not success:
+                        logger.error(f"Failed to flush {len(self._flushing_tracking)} member tracking rows, retrying next tick")
+                        self._requeue(self._pending_tracking, self._flushing_tracking, "member tracking")
+                if self._stats_flush_future:
+                    success = await asyncio.wrap_future(self._stats_flush_future)
+                    if not success:
+                        logger.error(f"Failed to flush {len(self._flushing_stats)} welcome stats rows, retrying next tick")
+                        self._requeue(self._pending_stats, self._flushing_stats, "welcome stats")
+            finally:
+                self._flushing_tracking = []
+                self._flushing_stats = []
+                self._tracking_flush_future = None
+                self._stats_flush_future = None
+
+    @tasks.loop(seconds=TRACKING_FLUSH_INTERVAL)
+    async def flush_tracking_loop(self):
+        await self._flush_tracking()
+
+    def _placeholders(self, member: discord.Member, guild: discord.Guild) -> dict:
+        return {
             "{user}": member.name,
             "{mention}": member.mention,
             "{server}": guild.name,
@@ -165,18 +303,18 @@ class WelcomeAutoRole(commands.Cog):
             "{guild}": guild.name
         }
 
-        for placeholder, value in replacements.items():
-            text = text.replace(placeholder, value)
+    def _format_message(self, text: str, placeholders: dict) -> str:
+        if not text:
+            return None
 
-        return text
+        if "{" not in text:
+            return text
+
+        return self.PLACEHOLDER_RE.sub(lambda match: placeholders[match.group(0)], text)
     
     def _parse_color(self, color_str: str) -> discord.Color:
-        try:
-            if color_str.startswith('#'):
-                color_str = color_str[1:]
-            return discord.Color(int(color_str, 16))
-        except:
-            return discord.Color.blue()
+        match = self.HEX_COLOR_RE.fullmatch(color_str) if color_str else None
+        return discord.Color(int(match.group(1), 16)) if match else discord.Color.blue()
     
     async def _send_welcome_message(self, member: discord.Member, settings: dict):
         if not settings["enabled"] or not settings["channel_id"]:
@@ -188,12 +326,13 @@ class WelcomeAutoRole(commands.Cog):
             return False
         
         try:
+            placeholders = self._placeholders(member, member.guild)
             if settings["message_type"] == "text":
-                message = self._format_message(settings["message_content"], member, member.guild)
+                message = self._format_message(settings["message_content"], placeholders)
                 if message:
                     await channel.send(message)
             elif settings["message_type"] == "embed":
-                embed = discord.Embed(title=self._format_message(settings["embed_title"], member, member.guild), description=self._format_message(settings["embed_description"], member, member.guild), color=self._parse_color(settings["embed_color"]), timestamp=datetime.utcnow())
+                embed = discord.Embed(title=self._format_message(settings["embed_title"], placeholders), description=self._format_message(settings["embed_description"], placeholders), color=settings["_color"], timestamp=datetime.utcnow())
 
                 if settings["embed_thumbnail"]:
                     embed.set_thumbnail(url=member.display_avatar.url)
@@ -202,7 +341,7 @@ class WelcomeAutoRole(commands.Cog):
                     embed.set_image(url=settings["embed_image_url"])
                 
                 if settings["embed_footer"]:
-                    footer_text = self._format_message(settings["embed_footer"], member, member.guild)
+                    footer_text = self._format_message(settings["embed_footer"], placeholders)
                     embed.set_footer(text=footer_text)
                 
                 await channel.send(embed=embed)
@@ -219,7 +358,7 @@ class WelcomeAutoRole(commands.Cog):
             return False
         
         try:
-            dm_text = self._format_message(settings["dm_message"], member, member.guild)
+            dm_text = self._format_message(settings["dm_message"], self._placeholders(member, member.guild))
             await member.send(dm_text)
             return True
         except discord.Forbidden:
@@ -239,13 +378,14 @@ class WelcomeAutoRole(commands.Cog):
             return False
         
         try:
+            placeholders = self._placeholders(member, member.guild)
             if settings["message_type"] == "text":
-                message = self._format_message(settings["message_content"], member, member.guild)
+                message = self._format_message(settings["message_content"], placeholders)
                 if message:
                     await channel.send(message)
             
             elif settings["message_type"] == "embed":
-                embed = discord.Embed(title=self._format_message(settings["embed_title"], member, member.guild), description=self._format_message(settings["embed_description"], member, member.guild), color=self._parse_color(settings["embed_color"]), timestamp=datetime.utcnow())
+                embed = discord.Embed(title=self._format_message(settings["embed_title"], placeholders), description=self._format_message(settings["embed_description"], placeholders), color=settings["_color"], timestamp=datetime.utcnow())
 
                 embed.set_thumbnail(url=member.display_avatar.url)
 
@@ -259,66 +399,81 @@ class WelcomeAutoRole(commands.Cog):
             logger.error(f"Error sending goodbye message: {e}")
             return False
     
+    async def _add_auto_roles(self, member: discord.Member, roles: list) -> int:
+        top_role = member.guild.me.top_role
+        assignable = []
+        for role in roles:
+            if role.managed or role >= top_role:
+                logger.warning(f"Cannot assign auto-role {role.name} in guild {member.guild.id}: role is managed or above the bot")
+            elif member.get_role(role.id) is None:
+                assignable.append(role)
+
+        if not assignable:
+            return 0
+
+        try:
+            # A non-atomic add is one PATCH of the member's full role list instead of one PUT per role, but it is built
+            # from our cache and will drop any role another bot or moderator adds in between, so only use it for several roles
+            await member.add_roles(*assignable, reason="Auto-role on join", atomic=len(assignable) == 1)
+            logger.info(f"Auto-assigned {len(assignable)} roles to {member} in {member.guild.name}")
+            return len(assignable)
+        except discord.Forbidden:
+            logger.warning(f"Missing permissions to assign auto-roles in guild {member.guild.id}")
+        except Exception as e:
+            logger.error(f"Error assigning auto-roles: {e}")
+        return 0
+
+    async def _add_delayed_auto_roles(self, member: discord.Member, roles: list, delay: int):
+        await asyncio.sleep(delay)
+        member = member.guild.get_member(member.id)
+        if member is None:
+            return
+        await self._add_auto_roles(member, roles)
+
     async def _assign_auto_roles(self, member: discord.Member):
-        auto_roles = self._get_auto_roles(member.guild.id, for_bots=member.bot)
+        auto_roles = await self._get_auto_roles(member.guild.id, for_bots=member.bot)
 
         if not auto_roles:
             return 0
-        
-        roles_assigned = 0
 
+        immediate = []
+        delayed = defaultdict(list)
         for role_data in auto_roles:
             role = member.guild.get_role(role_data["role_id"])
             if not role:
                 continue
 
             if role_data["delay_seconds"] > 0:
-                await asyncio.sleep(role_data["delay_seconds"])
+                delayed[role_data["delay_seconds"]].append(role)
+            else:
+                immediate.append(role)
 
-            try:
-                await member.add_roles(role, reason="Auto-role on join")
-                roles_assigned += 1
-                logger.info(f"Auto-assigned role {role.name} to {member} in {member.guild.name}")
-            except discord.Forbidden:
-                logger.warning(f"Missing permissions to assign auto-role {role.name} in guild {member.guild.id}")
-            except Exception as e:
-                logger.error(f"Error assigning auto-role: {e}")
-        
-        return roles_assigned
+        for delay, roles in delayed.items():
+            task = asyncio.create_task(self._add_delayed_auto_roles(member, roles, delay))
+            self._delayed_role_tasks.add(task)
+            task.add_done_callback(self._delayed_role_tasks.discard)
+
+        return await self._add_auto_roles(member, immediate)
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        self.db.insert("member_tracking", {
-            "guild_id": member.guild.id,
-            "user_id": member.id,
-            "action_type": "JOIN"
-        })
-
-        welcome_settings = self._get_welcome_settings(member.guild.id)
-
-        welcome_sent = await self._send_welcome_message(member, welcome_settings)
+        await self._queue_tracking(member.guild.id, member.id, "JOIN")
 
-        dm_sent = await self._send_dm_message(member, welcome_settings)
+        welcome_settings = await self._get_welcome_settings(member.guild.id)
 
-        roles_assigned = await self._assign_auto_roles(member)
+        welcome_sent, dm_sent, roles_assigned = await asyncio.gather(
+            self._send_welcome_message(member, welcome_settings),
+            self._send_dm_message(member, welcome_settings),
+            self._assign_auto_roles(member)
+        )
 
-        self.db.insert("welcome_stats", {
-            "guild_id": member.guild.id,
-            "user_id": member.id,
-            "welcome_sent": welcome_sent,
-            "dm_sent": dm_sent,
-            "roles_assigned": roles_assigned
-        })
+        await self._queue_stats(member.guild.id, member.id, welcome_sent, dm_sent, roles_assigned)
     
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
-        self.db.insert("member_tracking", {
-            "guild_id": member.guild.id,
-            "user_id": member.id,
-            "action_type": "LEAVE"
-        })
+        await self._queue_tracking(member.guild.id, member.id, "LEAVE")
 
-        goodbye_settings = self._get_goodbye_settings(member.guild.id)
+        goodbye_settings = await self._get_goodbye_settings(member.guild.id)
 
         await self._send_goodbye_message(member, goodbye_settings)
 
@@ -328,38 +483,30 @@ class WelcomeAutoRole(commands.Cog):
     @commands.has_guild_permissions(administrator=True)
     async def welcome_stats(self, ctx: discord.ApplicationContext, days: Option(int, description="Number of days to analyze", required=False, default=7, min_value=1, max_value=90)): #type: ignore
         await ctx.defer()
+        await self._flush_tracking()
 
         cutoff_date = datetime.utcnow() - timedelta(days=days)
 
-        join_query = """
-            SELECT COUNT(*) as count
-            FROM member_tracking
-            WHERE guild_id = %s AND action_type = 'JOIN' AND timestamp >= %s
+        query = """
+            SELECT tracking.joins, tracking.leaves, stats.welcomes, stats.dms, stats.roles
+            FROM (
+                SELECT
+                    COALESCE(SUM(action_type = 'JOIN'), 0) AS joins,
+                    COALESCE(SUM(action_type = 'LEAVE'), 0) AS leaves
+                FROM member_tracking
+                WHERE guild_id = %s AND timestamp >= %s
+            ) AS tracking
+            CROSS JOIN (
+                SELECT
+                    COALESCE(SUM(welcome_sent), 0) AS welcomes,
+                    COALESCE(SUM(dm_sent), 0) AS dms,
+                    COALESCE(SUM(roles_assigned), 0) AS roles
+                FROM welcome_stats
+                WHERE guild_id = %s AND join_date >= %s
+            ) AS stats
         """
-        joins = self.db.fetch_one(join_query, (ctx.guild.id, cutoff_date))
-        join_count = joins[0] if joins else 0
-
-        leave_query = """
-            SELECT COUNT(*) as count
-            FROM member_tracking
-            WHERE guild_id = %s AND action_type = 'LEAVE' AND timestamp >= %s
-        """
-        leaves = self.db.fetch_one(leave_query, (ctx.guild.id, cutoff_date))
-        leave_count = leaves[0] if leaves else 0
-
-        welcome_query = """
-            SELECT
-                SUM(welcome_sent) as welcomes,
-                SUM(dm_sent) as dms,
-                SUM(roles_assigned) as roles
-            FROM welcome_stats
-            WHERE guild_id = %s AND join_date >= %s
-        """
-        stats = self.db.fetch_one(welcome_query, (ctx.guild.id, cutoff_date))
-
-        welcomes_sent = stats[0] if stats and stats[0] else 0
-        dms_sent = stats[1] if stats and stats[1] else 0
-        roles_assigned = stats[2] if stats and stats[2] else 0
+        row = await self.db.run(self.db.fetch_one, query, (ctx.guild.id, cutoff_date, ctx.guild.id, cutoff_date))
+        join_count, leave_count, welcomes_sent, dms_sent, roles_assigned = (int(value) for value in row) if row else (0, 0, 0, 0, 0)
 
         net_growth = join_count - leave_count
 
@@ -11,7 +11,7 @@ MYSQL_CONFIG = {
     "user": os.getenv("MYSQL_USER", "root"),
     "password": os.getenv("MYSQL_PASSWORD", ""),
     "port": int(os.getenv("MYSQL_PORT", 3306)),
-    "pool_size": int(os.getenv("MYSQL_POOL_SIZE", 5))
+    "pool_size": int(os.getenv("MYSQL_POOL_SIZE", 20))
 }
 
 TOKEN = os.getenv("DISCORD_TOKEN")
\ No newline at end of file
@@ -1,16 +1,31 @@
 import mysql.connector
 from mysql.connector import Error, pooling
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Tuple, Callable, TypeVar
+import asyncio
+import functools
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+
+@functools.lru_cache(maxsize=256)
+def _insert_sql(table: str, columns: Tuple[str, ...]) -> str:
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+
+@functools.lru_cache(maxsize=256)
+def _update_sql(table: str, columns: Tuple[str, ...], where_clause: str) -> str:
+    return f"UPDATE {table} SET {', '.join(f'{column} = %s' for column in columns)} WHERE {where_clause}"
+
 
 class MySQLHelper:
 
-    def __init__(self, host: str, database: str, user: str, password: str, port: int = 3306, pool_name: str = "synergy_pro", pool_size: int = 5):
+    def __init__(self, host: str, database: str, user: str, password: str, port: int = 3306, pool_name: str = "synergy_pro", pool_size: int = 5, autocommit: bool = False, pool_reset_session: bool = False, time_zone: str = "+00:00"):
         self.host = host
         self.database = database 
         self.user = user
@@ -18,13 +33,19 @@ class MySQLHelper:
         self.port = port
         self.pool_name = pool_name
         self.pool_size = pool_size
+        self.autocommit = autocommit
+        self.pool_reset_session = pool_reset_session
+        # TIMESTAMP columns are written as naive UTC and read back with UNIX_TIMESTAMP, so sessions must run in UTC
+        self.time_zone = time_zone
         self.connection_pool = None
+        # One worker per pooled connection so offloaded queries never exhaust the pool
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=pool_name)
 
         self._create_pool()
 
     def _create_pool(self) -> None:
         try:
-            self.connection_pool = pooling.MySQLConnectionPool(pool_name=self.pool_name, pool_size=self.pool_size, pool_reset_session=True, host=self.host, database=self.database, user=self.user, password=self.password, port=self.port, autocommit=False)
+            self.connection_pool = pooling.MySQLConnectionPool(pool_name=self.pool_name, pool_size=self.pool_size, pool_reset_session=self.pool_reset_session, host=self.host, database=self.database, user=self.user, password=self.password, port=self.port, autocommit=self.autocommit, time_zone=self.time_zone)
             logger.info(f"MySQL connection pool created successfully: {self.pool_name}")
         except Error as e:
             logger.error(f"Error creating connection pool: {e}")
@@ -42,13 +63,30 @@ class MySQLHelper:
         finally:
             if connection and connection.is_connected():
                 connection.close()
+
+    def submit(self, func: Callable[..., T], *args, **kwargs) -> "Future[T]":
+        return self._executor.submit(func, *args, **kwargs)
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    @staticmethod
+    def succeeded(future: Optional[Future]) -> bool:
+        # Blocks until an already submitted write finishes; used by synchronous cog_unload hooks
+        if future is None:
+            return False
+        try:
+            return future.result() is not False
+        except Exception as e:
+            logger.error(f"Offloaded query failed: {e}")
+            return False
     
     def execute_query(self, query: str, params: Optional[tuple] = None, commit: bool = True) -> bool:
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute(query, params = ())
-                if commit:
+                cursor.execute(query, params or ())
+                if commit and not self.autocommit:
                     conn.commit()
                 cursor.close()
                 logger.info(f"Query executed successfully: {query[:50]}...")
@@ -57,6 +95,36 @@ class MySQLHelper:
             logger.error(f"Error executing query: {e}")
             return False
     
+    def execute_many(self, query: str, seq_params: List[Tuple], commit: bool = True) -> bool:
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(query, seq_params)
+                if commit and not self.autocommit:
+                    conn.commit()
+                rows_affected = cursor.rowcount
+                cursor.close()
+                logger.info(f"Batch executed successfully ({rows_affected} rows): {query[:50]}...")
+                return True
+        except Error as e:
+            logger.error(f"Error executing batch: {e}")
+            return False
+
+    def execute_many_queries(self, queries: List[str], commit: bool = True) -> bool:
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                for query in queries:
+                    cursor.execute(query)
+                if commit and not self.autocommit:
+                    conn.commit()
+                cursor.close()
+                logger.info(f"Executed {len(queries)} queries on one connection")
+                return True
+        except Error as e:
+            logger.error(f"Error executing queries: {e}")
+            return False
+
     def fetch_one(self, query: str, params: Optional[Tuple] = None) -> Optional[Tuple]:
         try:
             with self.get_connection() as conn:
@@ -106,15 +174,14 @@ class MySQLHelper:
             return []
     
     def insert(self, table: str, data: Dict[str, Any]) -> Optional[int]:
-        columns = ", ".join(data.keys())
-        placeholders = ", ".join(["%s"] * len(data))
-        query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+        query = _insert_sql(table, tuple(data))
         
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(query, tuple(data.values()))
-                conn.commit()
+                if not self.autocommit:
+                    conn.commit()
                 last_id = cursor.lastrowid
                 cursor.close()
                 logger.info(f"Inserted row into {table} with ID: {last_id}")
@@ -123,16 +190,23 @@ class MySQLHelper:
             logger.error(f"Error inserting into {table}: {e}")
             return None
     
+    def insert_many(self, table: str, rows: List[Dict[str, Any]]) -> bool:
+        if not rows:
+            return True
+
+        query = _insert_sql(table, tuple(rows[0]))
+        return self.execute_many(query, [tuple(row.values()) for row in rows])
+
     def update(self, table: str, data: Dict[str, Any], where_clause: str, where_params: Optional[Tuple] = None) -> bool:
-        set_clause = ", ".join([f"{key} = %s" for key in data.keys()])
-        query = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
+        query = _update_sql(table, tuple(data), where_clause)
         params = tuple(data.values()) + (where_params or ())
 
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(query, params)
-                conn.commit()
+                if not self.autocommit:
+                    conn.commit()
                 rows_affected = cursor.rowcount
                 cursor.close()
                 logger.info(f"Updated {rows_affected} rows in {table}")
@@ -147,7 +221,8 @@ class MySQLHelper:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(query, where_params or ())
-                conn.commit()
+                if not self.autocommit:
+                    conn.commit()
                 rows_affected = cursor.rowcount
                 cursor.close()
                 logger.info(f"Deleted {rows_affected} rows from {table}")
@@ -165,11 +240,30 @@ class MySQLHelper:
         result = self.fetch_one(query, (self.database, table_name))
         return result[0] > 0 if result else False
     
+    def index_exists(self, table_name: str, index_name: str) -> bool:
+        query = """
+            SELECT COUNT(*)
+            FROM information_schema.statistics
+            WHERE table_schema = %s AND table_name = %s AND index_name = %s
+        """
+        result = self.fetch_one(query, (self.database, table_name, index_name))
+        return result[0] > 0 if result else False
+    
+    def column_type(self, table_name: str, column_name: str) -> Optional[str]:
+        query = """
+            SELECT DATA_TYPE
+            FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s AND column_name = %s
+        """
+        result = self.fetch_one(query, (self.database, table_name, column_name))
+        return result[0].lower() if result else None
+    
     def create_table(self, create_query: str) -> bool:
         return self.execute_query(create_query)
     
     def close_pool(self) -> None:
         try:
+            self._executor.shutdown(wait=True)
             if self.connection_pool:
                 logger.info("Connection pool cleanup completed")
         except Error as e:
@@ -196,4 +290,12 @@ class MySQLHelper:
             ON DUPLICATE KEY UPDATE {update_clause}
         """
 
-        return self.execute_query(query, tuple(data.values()))
\ No newline at end of file
+        return self.execute_query(query, tuple(data.values()))
+
+    def ensure_guild(self, guild_id: int) -> bool:
+        query = """
+            INSERT INTO guilds (guild_id)
+            VALUES (%s)
+            ON DUPLICATE KEY UPDATE guild_id = guild_id
+        """
+        return self.execute_query(query, (guild_id,))